@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Script to compare two RPE-021 end states and produce the upserts and deletes
+needed to turn the first into the second:
+    diff_endstate.py OLD NEW [-o diff.json] [--apply URL]
+
+OLD and NEW are end-state files (JSON array or NDJSON, optionally .gz, "-" for
+stdin) or the base URL of a live REST API, which is read with
+RPE21Client.getElements. Elements are compared by ID and content, ignoring null
+fields and timestamp formatting, so resyncing a server only sends what changed.
+
+Files are streamed (see rpe021_stream.py): only the ID, type and a digest of
+each OLD element are kept in memory, and NEW is never held in memory at all.
+
+The output is {"upserts": [...], "deletes": [...]}, where upserts can be sent
+as is with RPE21Client.uploadElements. With --apply, the changes are also sent
+to the given server, in batches.
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sys
+
+import rpe021_stream
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server_validation'))
+
+# Delete connections before the endpoints and networks they refer to
+DELETE_ORDER = {'connection': 0, 'endpoint': 1, 'network': 2}
+
+
+def isURL(source):
+    return source.startswith('http://') or source.startswith('https://')
+
+
+def createClient(url, args):
+    import rpe21_client
+    headers = dict(header.split(':', 1) for header in args.header)
+    headers = {key.strip(): value.strip() for key, value in headers.items()}
+    return rpe21_client.RPE21Client(url, headers)
+
+
+def readElements(source, args):
+    """Yield the elements of an end-state file or live server."""
+    if isURL(source):
+        yield from createClient(source, args).getElements()
+    else:
+        yield from rpe021_stream.read_elements(source)
+
+
+def normalizeTimestamp(timestamp):
+    """Return an ISO 8601 timestamp in a canonical form, e.g. without 'Z'."""
+    if not isinstance(timestamp, str):
+        return timestamp
+    try:
+        value = timestamp[:-1] + '+00:00' if timestamp.endswith('Z') else timestamp
+        return datetime.datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        return timestamp
+
+
+def stripNulls(value):
+    if isinstance(value, dict):
+        return {key: stripNulls(item) for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        return [stripNulls(item) for item in value]
+    return value
+
+
+def digestElement(element):
+    """Return a digest of an element that ignores null fields, key order and
+    timestamp formatting.
+    """
+    canonical = stripNulls(element)
+    if 'timestamp' in canonical:
+        canonical['timestamp'] = normalizeTimestamp(canonical['timestamp'])
+    data = json.dumps(canonical, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).digest()
+
+
+def indexElements(source, args):
+    """Map each element ID of an end state to its (digest, elem_type)."""
+    index = {}
+    for element in readElements(source, args):
+        index[element['id']] = (digestElement(element), element.get('elem_type'))
+    return index
+
+
+def diffElements(old, newSource, args):
+    """Yield ('upsert', element) for each element of NEW that is missing from or
+    different in OLD, then ('delete', id) for each element only in OLD.
+    """
+    for element in readElements(newSource, args):
+        previous = old.pop(element['id'], None)
+        if previous is None or previous[0] != digestElement(element):
+            yield 'upsert', element
+    for id, (digest, elemType) in sorted(old.items(), key=lambda item: DELETE_ORDER.get(item[1][1], 3)):
+        yield 'delete', id
+
+
+class DiffWriter:
+    """Streams the diff as JSON: all upserts come before the deletes."""
+
+    def __init__(self, f):
+        self.f = f
+        self.section = 'upserts'
+        self.count = 0
+        self.f.write('{"upserts": [')
+
+    def write(self, kind, value):
+        if kind == 'delete' and self.section == 'upserts':
+            self.f.write('\n],\n"deletes": [')
+            self.section = 'deletes'
+            self.count = 0
+        self.f.write(',\n' if self.count else '\n')
+        self.f.write(json.dumps(value))
+        self.count += 1
+
+    def close(self):
+        if self.section == 'upserts':
+            self.f.write('\n],\n"deletes": [')
+        self.f.write('\n]}\n')
+
+
+def diffEndStates(args):
+    old = indexElements(args.old, args)
+    writer = None
+    if args.output or not args.apply:
+        f = open(args.output, 'w') if args.output and args.output != '-' else sys.stdout
+        writer = DiffWriter(f)
+    client = createClient(args.apply, args) if args.apply else None
+
+    batch = []
+    upserts = 0
+    deletes = 0
+    for kind, value in diffElements(old, args.new, args):
+        if writer:
+            writer.write(kind, value)
+        if kind == 'upsert':
+            upserts += 1
+            if client:
+                batch.append(value)
+                if len(batch) >= args.batch_size:
+                    client.uploadElements(batch)
+                    batch = []
+        else:
+            deletes += 1
+            if client:
+                if batch:
+                    client.uploadElements(batch)
+                    batch = []
+                client.deleteElement(value)
+    if client and batch:
+        client.uploadElements(batch)
+    if writer:
+        writer.close()
+        if writer.f is not sys.stdout:
+            writer.f.close()
+    print('%d upserts, %d deletes' % (upserts, deletes), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('old', help="current end-state file or REST API base URL")
+    parser.add_argument('new', help="desired end-state file or REST API base URL")
+    parser.add_argument('-o', '--output', help="diff output file (default: stdout, unless --apply is given)")
+    parser.add_argument('--apply', metavar='URL', help="send the changes to this REST API base URL")
+    parser.add_argument('--header', action='append', default=[], help="extra HTTP header, e.g., 'X-API-Key: 1234'")
+    parser.add_argument('--batch-size', type=int, default=1000, help="elements per bulk upload with --apply")
+    args = parser.parse_args()
+
+    diffEndStates(args)
@@ -7,14 +7,253 @@ valid JSON data will be sent to competitor solutions.
 Copyright 2022, Maryland Innovation and Security Institute
 """
 
-from fastapi import FastAPI, HTTPException, Response
+from fastapi import Body, Depends, FastAPI, Header, HTTPException, Request, Response
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import Dict, List, Optional
+from pydantic import BaseModel, ValidationError
+from starlette.datastructures import Headers, MutableHeaders
+import gc
+import gzip
+import io
+import json
+import math
+import os
+import queue
+import re
+import threading
+import time
+
+import rpe021_stream
+
+# Optional wire formats - the server still speaks plain JSON without these
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+# The layout engine and renderer require NumPy
+try:
+    import rpe021_layout
+    import rpe021_render
+except ImportError:
+    rpe021_layout = None
+    rpe021_render = None
 
 app = FastAPI()
 
-elements = {}
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+
+# Responses smaller than this aren't worth compressing
+MIN_COMPRESS_SIZE = 500
+
+# Request headers that JSON responses are negotiated on
+VARY = 'Accept, Accept-Encoding, Prefer'
+
+# Largest request body a compressed request may expand to
+MAX_DECODED_SIZE = int(os.environ.get('RPE021_MAX_DECODED_SIZE', str(256 * 1024 * 1024)))
+
+
+class RequestTooLarge(Exception):
+    pass
+
+
+def strip_nulls(value):
+    """Recursively drop null/absent fields from decoded JSON data."""
+    if isinstance(value, dict):
+        return {k: strip_nulls(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [strip_nulls(v) for v in value]
+    return value
+
+
+class WireFormatMiddleware:
+    """ASGI middleware that negotiates the wire format of request and response
+    bodies, so the API handlers below only ever see and produce plain JSON.
+
+    Requests may be sent as MessagePack (Content-Type: application/msgpack)
+    and/or compressed (Content-Encoding: gzip or zstd). Responses are encoded
+    according to the Accept and Accept-Encoding headers. Null fields are left
+    out of MessagePack responses, and out of JSON responses when the client
+    sends "Prefer: omit-nulls". Without any of these headers the API behaves
+    exactly as before.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        content_type = headers.get('content-type', '').split(';')[0].strip().lower()
+        content_encoding = headers.get('content-encoding', '').strip().lower()
+        if content_type in MSGPACK_TYPES or content_encoding not in ('', 'identity'):
+            error = None
+            try:
+                body = await self._read_body(receive)
+                body = self._decode_body(body, content_type, content_encoding)
+            except RequestTooLarge as e:
+                error = (413, str(e))
+            except LookupError as e:
+                error = (415, str(e))
+            except Exception as e:
+                error = (400, 'Unable to decode request body: %s' % (e,))
+            if error:
+                await self._send_json(send, error[0], {'detail': error[1]})
+                return
+            scope = dict(scope)
+            scope['headers'] = [(k, v) for k, v in scope['headers']
+                if k not in (b'content-type', b'content-encoding', b'content-length')]
+            scope['headers'] += [(b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode())]
+            receive = self._replay(body)
+
+        use_msgpack = msgpack is not None and any(
+            t.split(';')[0].strip().lower() in MSGPACK_TYPES for t in headers.get('accept', '').split(','))
+        omit_nulls = use_msgpack or 'omit-nulls' in headers.get('prefer', '').lower()
+        accepted = [e.split(';')[0].strip().lower() for e in headers.get('accept-encoding', '').split(',')]
+        compression = None
+        if 'zstd' in accepted and zstandard is not None:
+            compression = 'zstd'
+        elif 'gzip' in accepted:
+            compression = 'gzip'
+
+        if not (use_msgpack or omit_nulls or compression):
+            # Plain responses still vary, or a shared cache could serve them
+            # (or their encoded form, which has the same ETag) to anyone
+            async def send_plain(message):
+                await send(self._add_vary(message))
+
+            await self.app(scope, receive, send_plain)
+            return
+
+        start = {}
+        chunks = []
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                resp_headers = Headers(raw=message['headers'])
+                if resp_headers.get('content-type', '').startswith('application/json'):
+                    start['message'] = message
+                    return
+            elif message['type'] == 'http.response.body' and 'message' in start:
+                chunks.append(message.get('body', b''))
+                if message.get('more_body', False):
+                    return
+                await self._send_encoded(send, start['message'], b''.join(chunks),
+                    use_msgpack, omit_nulls, compression)
+                return
+            await send(self._add_vary(message))
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _add_vary(message):
+        """Add Vary to the start of a JSON (or bodiless, e.g. 304) response."""
+        if message['type'] != 'http.response.start':
+            return message
+        headers = MutableHeaders(raw=list(message['headers']))
+        content_type = headers.get('content-type')
+        if content_type is not None and not content_type.startswith('application/json'):
+            return message
+        headers.append('vary', VARY)
+        return dict(message, headers=headers.raw)
+
+    @staticmethod
+    async def _read_body(receive):
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+        return body
+
+    @staticmethod
+    def _replay(body):
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if sent:
+                return {'type': 'http.disconnect'}
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        return receive
+
+    @staticmethod
+    def _decode_body(body, content_type, content_encoding):
+        """Turn a negotiated request body back into plain JSON bytes."""
+        if content_encoding == 'gzip':
+            body = WireFormatMiddleware._decompress(gzip.GzipFile(fileobj=io.BytesIO(body)))
+        elif content_encoding == 'zstd':
+            if zstandard is None:
+                raise LookupError('zstd request bodies are not supported by this server')
+            body = WireFormatMiddleware._decompress(zstandard.ZstdDecompressor().stream_reader(
+                io.BytesIO(body), read_across_frames=True))
+        elif content_encoding not in ('', 'identity'):
+            raise LookupError('Content-Encoding %s is not supported by this server' % (content_encoding,))
+        if content_type in MSGPACK_TYPES:
+            if msgpack is None:
+                raise LookupError('MessagePack request bodies are not supported by this server')
+            body = json.dumps(msgpack.unpackb(body)).encode()
+        return body
+
+    @staticmethod
+    def _decompress(reader):
+        """Read a decompressing stream, giving up once the output would exceed
+        MAX_DECODED_SIZE rather than inflating a decompression bomb.
+        """
+        chunks = []
+        size = 0
+        while True:
+            chunk = reader.read(1024 * 1024)
+            if not chunk:
+                return b''.join(chunks)
+            size += len(chunk)
+            if size > MAX_DECODED_SIZE:
+                raise RequestTooLarge('Decompressed request body exceeds %d bytes' % (MAX_DECODED_SIZE,))
+            chunks.append(chunk)
+
+    @staticmethod
+    async def _send_encoded(send, start, body, use_msgpack, omit_nulls, compression):
+        headers = MutableHeaders(raw=list(start['headers']))
+        # Compression alone doesn't need the body decoded and re-encoded
+        if body and (use_msgpack or omit_nulls):
+            data = json.loads(body)
+            if omit_nulls:
+                data = strip_nulls(data)
+            if use_msgpack:
+                body = msgpack.packb(data)
+                headers['content-type'] = 'application/msgpack'
+            else:
+                body = json.dumps(data, separators=(',', ':')).encode()
+        if compression and len(body) >= MIN_COMPRESS_SIZE:
+            if compression == 'zstd':
+                body = zstandard.ZstdCompressor().compress(body)
+            else:
+                body = gzip.compress(body, compresslevel=6)
+            headers['content-encoding'] = compression
+        headers.append('vary', VARY)
+        headers['content-length'] = str(len(body))
+        await send({'type': 'http.response.start', 'status': start['status'], 'headers': headers.raw})
+        await send({'type': 'http.response.body', 'body': body})
+
+    @staticmethod
+    async def _send_json(send, status, content):
+        body = json.dumps(content).encode()
+        await send({'type': 'http.response.start', 'status': status, 'headers': [
+            (b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+app.add_middleware(WireFormatMiddleware)
 
 # Structure for a network interface
 class Interface(BaseModel):
@@ -48,84 +287,1018 @@ class Element(BaseModel):
     line_type: Optional[str]
 
 
+ELEMENT_FIELDS = tuple(Element.__fields__)
+INTERFACE_FIELDS = tuple(Interface.__fields__)
+# Element fields that hold plain strings, and those that are required
+STRING_FIELDS = tuple(field for field in ELEMENT_FIELDS if field not in ('timestamp', 'interfaces'))
+REQUIRED_FIELDS = ('id', 'label', 'color', 'elem_type')
+
+
+def construct_model(cls, fields, data):
+    """Build a model from data without any validation."""
+    model = cls.__new__(cls)
+    object.__setattr__(model, '__dict__', {field: data.get(field) for field in fields})
+    object.__setattr__(model, '__fields_set__', set(fields).intersection(data))
+    return model
+
+
+def check_strings(values, fields, required):
+    for field in fields:
+        value = values[field]
+        if type(value) is not str and (value is not None or field in required):
+            raise TypeError(field)
+
+
+def load_element(data):
+    """Build an Element from decoded JSON, as Element.parse_obj would, but
+    skipping pydantic validation for the plain strings of well-formed
+    end-state data. Anything else falls back to full validation, so invalid
+    data still raises a ValidationError.
+    """
+    element = construct_model(Element, ELEMENT_FIELDS, data)
+    values = element.__dict__
+    try:
+        check_strings(values, STRING_FIELDS, REQUIRED_FIELDS)
+        timestamp = values['timestamp']
+        if timestamp[10:11] not in ('T', ' '):
+            raise ValueError(timestamp)
+        if timestamp.endswith('Z'):
+            timestamp = timestamp[:-1] + '+00:00'
+        values['timestamp'] = datetime.fromisoformat(timestamp)
+        if values['interfaces'] is not None:
+            interfaces = [construct_model(Interface, INTERFACE_FIELDS, iface) for iface in values['interfaces']]
+            for iface in interfaces:
+                check_strings(iface.__dict__, INTERFACE_FIELDS, ('label', 'interface_id'))
+            values['interfaces'] = interfaces
+    except (AttributeError, TypeError, ValueError):
+        return Element.parse_obj(data)
+    return element
+
+
+# Integrity modes: "lenient" only tracks dangling references, "strict" rejects
+# mutations that would create them, and "cascade" deletes elements whose
+# references would be left dangling by a delete/update
+INTEGRITY_MODES = ('lenient', 'strict', 'cascade')
+INTEGRITY_MODE = os.environ.get('RPE021_INTEGRITY', 'lenient')
+if INTEGRITY_MODE not in INTEGRITY_MODES:
+    raise ValueError('Invalid RPE021_INTEGRITY "%s", expected one of %s' % (INTEGRITY_MODE, ', '.join(INTEGRITY_MODES)))
+
+
+class ReferenceIndex:
+    """Incrementally maintained index of the references between elements.
+
+    A reference target is a (kind, key) pair - ('network', <network id>) is
+    provided by a network element and ('interface', <interface_id>) by an
+    endpoint. Endpoints refer to their network, and connections to their
+    interface_from/interface_to interfaces. Each mutation only touches the
+    entries of the element being changed, so keeping the set of dangling
+    references current costs O(changed elements), never a full-graph audit.
+    """
+
+    def __init__(self):
+        self.providers = {}  # target -> set of element IDs providing it
+        self.referrers = {}  # target -> set of (element ID, field) referring to it
+        self.dangling = set()  # (element ID, field, target) with no provider
+
+    def clear(self):
+        self.providers.clear()
+        self.referrers.clear()
+        self.dangling.clear()
+
+    @staticmethod
+    def targets_of(element):
+        """Return the reference targets an element provides."""
+        if element.elem_type == 'network':
+            return [('network', element.id)]
+        if element.elem_type == 'endpoint' and element.interfaces:
+            return [('interface', iface.interface_id) for iface in element.interfaces]
+        return []
+
+    @staticmethod
+    def references_of(element):
+        """Return the (field, target) references an element makes."""
+        refs = []
+        if element.elem_type == 'endpoint' and element.network:
+            refs.append(('network', ('network', element.network)))
+        elif element.elem_type == 'connection':
+            for field in ('interface_from', 'interface_to'):
+                value = getattr(element, field)
+                if value:
+                    refs.append((field, ('interface', value)))
+        return refs
+
+    def add(self, element):
+        """Index a newly stored element."""
+        id = element.id
+        for target in self.targets_of(element):
+            owners = self.providers.setdefault(target, set())
+            if not owners:
+                for field_ref in self.referrers.get(target, ()):
+                    self.dangling.discard(field_ref + (target,))
+            owners.add(id)
+        for field, target in self.references_of(element):
+            self.referrers.setdefault(target, set()).add((id, field))
+            if not self.providers.get(target):
+                self.dangling.add((id, field, target))
+
+    def remove(self, element):
+        """Drop a stored element from the index."""
+        id = element.id
+        for field, target in self.references_of(element):
+            refs = self.referrers.get(target)
+            if refs is not None:
+                refs.discard((id, field))
+                if not refs:
+                    del self.referrers[target]
+            self.dangling.discard((id, field, target))
+        for target in self.targets_of(element):
+            owners = self.providers.get(target)
+            if owners is None:
+                continue
+            owners.discard(id)
+            if not owners:
+                del self.providers[target]
+                for field_ref in self.referrers.get(target, ()):
+                    self.dangling.add(field_ref + (target,))
+
+    def rebuild(self, elements):
+        """Re-index a whole set of elements at once, e.g. after a bulk load.
+        Unlike a series of add() calls, no reference is ever marked dangling
+        and then resolved by a later element.
+        """
+        self.clear()
+        for element in elements:
+            for target in self.targets_of(element):
+                self.providers.setdefault(target, set()).add(element.id)
+        for element in elements:
+            for field, target in self.references_of(element):
+                self.referrers.setdefault(target, set()).add((element.id, field))
+                if target not in self.providers:
+                    self.dangling.add((element.id, field, target))
+
+    def refcount(self, target):
+        """Return the number of references to a target."""
+        return len(self.referrers.get(target, ()))
+
+    def unresolved(self, element, pending=()):
+        """Return the references of an element that neither a stored element
+        nor the pending set of targets would provide.
+        """
+        return [(field, target) for field, target in self.references_of(element)
+            if not self.providers.get(target) and target not in pending]
+
+    def orphans(self, old, new=None):
+        """Return the IDs of other elements whose references would be left
+        dangling if the stored element old were deleted (or replaced by new).
+        """
+        kept = set(self.targets_of(new)) if new is not None else set()
+        ids = set()
+        for target in self.targets_of(old):
+            if target in kept or self.providers.get(target, set()) - {old.id}:
+                continue
+            ids.update(id for id, field in self.referrers.get(target, ()) if id != old.id)
+        return ids
+
+
+# Namespace quotas and eviction - 0 means unlimited / never evicted
+MAX_ELEMENTS = int(os.environ.get('RPE021_MAX_ELEMENTS', '0'))
+MAX_NAMESPACES = int(os.environ.get('RPE021_MAX_NAMESPACES', '0'))
+IDLE_TIMEOUT = float(os.environ.get('RPE021_IDLE_TIMEOUT', '3600'))
+
+# Deleted element IDs remembered for delta reads (GET /elements?since=...)
+MAX_TOMBSTONES = 10000
+
+DEFAULT_NAMESPACE = 'default'
+NAMESPACE_HEADER = 'x-rpe21-namespace'
+NAMESPACE_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+
+class ElementStore:
+    """An independent set of elements, with its own indexes and revision
+    counter. Each namespace served by the API has one.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.elements = {}
+        self.refs = ReferenceIndex()
+        self.layout = rpe021_layout.LayoutEngine() if rpe021_layout is not None else None
+        # Incremented on every mutation
+        self.revision = 0
+        # Change log for ETags and delta reads: element ID -> revision of its
+        # last change or deletion, oldest first. Changes before history_start
+        # have been forgotten. The epoch tells ETags of a namespace apart from
+        # those of an earlier, evicted namespace of the same name.
+        self.changes = OrderedDict()
+        self.history_start = 0
+        self.epoch = os.urandom(4).hex()
+        self.last_access = time.monotonic()
+        # Guards mutations, which may come from the ingest applier thread as
+        # well as from request handlers
+        self.lock = threading.RLock()
+        # Ingest revisions of the batches queued for / applied by the ingest
+        # applier, and the number of stale updates it dropped
+        self.ingest_accepted = 0
+        self.ingest_applied = 0
+        self.ingest_dropped = 0
+        self.ingest_applied_cond = threading.Condition(self.lock)
+
+    def ingest_pending(self):
+        """Return whether batches queued for this store are yet to be applied."""
+        return self.ingest_applied < self.ingest_accepted
+
+    def find(self, id):
+        """Look up an element by ID or throw a HTTP 404 response."""
+        if id in self.elements:
+            return self.elements[id]
+        else:
+            raise HTTPException(status_code=404, detail='Element ID not found')
+
+    def put(self, element, mode='lenient'):
+        """Add or replace an element, keeping the indexes current. In strict
+        mode a 409 is raised rather than leaving other elements dangling; in
+        cascade mode those elements are deleted.
+        """
+        with self.lock:
+            id = element.id
+            orig = self.elements.get(id)
+            if orig is None:
+                if MAX_ELEMENTS and len(self.elements) >= MAX_ELEMENTS:
+                    raise HTTPException(status_code=413, detail='Namespace element quota exceeded')
+            else:
+                if mode != 'lenient':
+                    orphans = self.refs.orphans(orig, element)
+                    if orphans and mode == 'strict':
+                        raise HTTPException(status_code=409, detail='Update would orphan elements: %s' % (sorted(orphans),))
+                    for orphan in orphans:
+                        self.remove(orphan, mode)
+                self.refs.remove(orig)
+            self.elements[id] = element
+            self.refs.add(element)
+            if self.layout is not None:
+                self.layout.update(element)
+            self.revision += 1
+            self.touch(id)
+
+    def remove(self, id, mode='lenient'):
+        """Delete an element (and, in cascade mode, its dependents), keeping
+        the indexes current. In strict mode a 409 is raised instead of leaving
+        other elements dangling.
+        """
+        with self.lock:
+            element = self.elements.get(id)
+            if element is None:
+                return None
+            orphans = self.refs.orphans(element) if mode != 'lenient' else ()
+            if orphans and mode == 'strict':
+                raise HTTPException(status_code=409, detail='Delete would orphan elements: %s' % (sorted(orphans),))
+            del self.elements[id]
+            self.refs.remove(element)
+            if self.layout is not None:
+                self.layout.remove(id)
+            self.revision += 1
+            self.touch(id)
+            for orphan in orphans:
+                self.remove(orphan, mode)
+            return element
+
+    def load(self, elements):
+        """Bulk-add or replace elements, e.g. when preloading an end state.
+        The reference index is rebuilt once for the whole store rather than
+        updated per element, and neither integrity modes nor the element quota
+        apply.
+        """
+        with self.lock:
+            for element in elements:
+                self.elements[element.id] = element
+            self.refs.rebuild(self.elements.values())
+            if self.layout is not None:
+                for element in elements:
+                    self.layout.update(element)
+            self.revision += 1
+            for element in elements:
+                self.touch(element.id)
+
+    def clear(self):
+        with self.lock:
+            self.elements.clear()
+            self.refs.clear()
+            if self.layout is not None:
+                self.layout.clear()
+            self.revision += 1
+            self.changes.clear()
+            self.history_start = self.revision
+
+    def touch(self, id):
+        """Log a change to (or deletion of) an element at the current
+        revision. Once more than MAX_TOMBSTONES deleted IDs could be logged,
+        the oldest changes are forgotten.
+        """
+        self.changes[id] = self.revision
+        self.changes.move_to_end(id)
+        while len(self.changes) > len(self.elements) + MAX_TOMBSTONES:
+            _, self.history_start = self.changes.popitem(last=False)
+
+    def etag(self, id=None):
+        """Return the (weak) ETag of an element, or of the whole store."""
+        if id is None:
+            revision = self.revision
+        else:
+            # Elements whose last change was forgotten haven't changed since
+            revision = self.changes.get(id, self.history_start)
+        return 'W/"%s-%d"' % (self.epoch, revision)
+
+    def changed_since(self, etag):
+        """Return the elements changed and the IDs deleted since the store had
+        the given ETag, or None if that can't be told.
+        """
+        try:
+            epoch, revision = etag_value(etag).rsplit('-', 1)
+            revision = int(revision)
+        except ValueError:
+            return None
+        if epoch != self.epoch or not self.history_start <= revision <= self.revision:
+            return None
+        changed = []
+        deleted = []
+        for id, changed_at in reversed(self.changes.items()):
+            if changed_at <= revision:
+                break
+            element = self.elements.get(id)
+            if element is None:
+                deleted.append(id)
+            else:
+                changed.append(element)
+        return changed, deleted
+
+
+def etag_value(etag):
+    """Strip the weak prefix and quotes from an ETag."""
+    etag = etag.strip()
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    return etag.strip('"')
+
+
+def etag_matches(if_none_match, etag):
+    """Return whether an If-None-Match header matches an ETag, using the weak
+    comparison required for If-None-Match.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(etag_value(tag) == etag_value(etag) for tag in if_none_match.split(','))
+
+
+class StoreRegistry:
+    """Maps namespace names to their element stores, creating stores on the
+    first request that may add elements and evicting those left idle for
+    longer than IDLE_TIMEOUT. The default namespace is never evicted, and no
+    namespace is dropped or evicted while it has ingest batches to apply.
+
+    Since namespaces share nothing, they could also be sharded across server
+    processes by routing on the namespace header or /ns/<name> path prefix.
+    """
+
+    def __init__(self):
+        self.stores = {DEFAULT_NAMESPACE: ElementStore(DEFAULT_NAMESPACE)}
+        # Reentrant so that IngestQueue.submit() can hold it around get()
+        self.lock = threading.RLock()
+        self.last_sweep = time.monotonic()
+
+    def get(self, name, create=True):
+        """Return the store of a namespace. Without create, a namespace that
+        doesn't exist is not registered (or counted towards the quota); an
+        empty, unregistered store is returned instead.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if IDLE_TIMEOUT and now - self.last_sweep > min(IDLE_TIMEOUT, 60.0):
+                self.evict_idle(now)
+            store = self.stores.get(name)
+            if store is None:
+                if not create:
+                    return ElementStore(name)
+                if MAX_NAMESPACES and len(self.stores) >= MAX_NAMESPACES:
+                    raise HTTPException(status_code=503, detail='Too many namespaces')
+                store = self.stores[name] = ElementStore(name)
+            store.last_access = now
+            return store
+
+    def drop(self, store):
+        """Forget a namespace's store, e.g. once its elements have all been
+        deleted. The default namespace is only ever cleared, and a namespace
+        with ingest batches still queued is kept so that they aren't lost.
+        """
+        with self.lock:
+            name = store.name
+            if name != DEFAULT_NAMESPACE and self.stores.get(name) is store and not store.ingest_pending():
+                del self.stores[name]
+
+    def evict_idle(self, now):
+        self.last_sweep = now
+        for name, store in list(self.stores.items()):
+            if name != DEFAULT_NAMESPACE and now - store.last_access > IDLE_TIMEOUT \
+                    and not store.ingest_pending():
+                del self.stores[name]
+
+
+stores = StoreRegistry()
+
+# Maximum number of bulk uploads waiting in the ingest queue
+INGEST_QUEUE_SIZE = int(os.environ.get('RPE021_INGEST_QUEUE_SIZE', '1000'))
+
+# Maximum number of queued bulk uploads merged into one apply
+INGEST_MERGE_LIMIT = 64
+
+
+def put_elements(store, elem_list, mode):
+    """Add or replace a list of elements, skipping those the integrity mode or
+    element quota rejects, and return the IDs stored. In strict mode,
+    references may also be satisfied by later elements in the same list.
+    """
+    pending = set()
+    if mode == 'strict':
+        for element in elem_list:
+            pending.update(store.refs.targets_of(element))
+    stored = []
+    with store.lock:
+        for element in elem_list:
+            if mode == 'strict' and store.refs.unresolved(element, pending):
+                continue
+            # NOTE: Older API version only allowed new elements and rejected
+            # changes to existing elements
+            try:
+                store.put(element, mode)
+            except HTTPException:
+                continue
+            stored.append(element.id)
+    return stored
+
+
+def is_stale(element, orig):
+    """Return whether element is an older version of the stored element orig."""
+    try:
+        return element.timestamp < orig.timestamp
+    except TypeError:
+        # Naive and timezone-aware timestamps can't be compared
+        return False
+
+
+class IngestQueue:
+    """Bounded queue of bulk uploads, applied asynchronously by a single
+    applier thread. Whatever has been queued up while a batch was being
+    applied is merged and applied in one go, keeping only the newest version
+    of each element; updates older than the stored element are dropped.
+    """
+
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize)
+        self.lock = threading.Lock()
+        self.thread = None
+        # Moving average of the time taken to apply a batch, for Retry-After
+        self.apply_seconds = 0.01
+
+    def submit(self, store, elem_list, mode):
+        """Queue a list of elements for a store and return its ingest revision,
+        or 429 if the queue is full.
+        """
+        # The namespace may have been dropped since the request resolved its
+        # store; under the registry lock it can't be dropped again before the
+        # batch counts as pending
+        with stores.lock, self.lock:
+            store = stores.get(store.name)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='ingest-applier', daemon=True)
+                self.thread.start()
+            try:
+                self.queue.put_nowait((store, store.ingest_accepted + 1, elem_list, mode))
+            except queue.Full:
+                retry = max(1, math.ceil(self.queue.qsize() * self.apply_seconds))
+                raise HTTPException(status_code=429, detail='Ingest queue is full',
+                    headers={'Retry-After': str(retry)})
+            store.ingest_accepted += 1
+            return store.ingest_accepted
+
+    def run(self):
+        while True:
+            batches = [self.queue.get()]
+            while len(batches) < INGEST_MERGE_LIMIT:
+                try:
+                    batches.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            start = time.perf_counter()
+            # Merge by store and integrity mode, in queue order
+            merged = {}
+            revisions = {}
+            for store, revision, elem_list, mode in batches:
+                pending = merged.setdefault((store, mode), {})
+                for element in elem_list:
+                    prev = pending.get(element.id)
+                    if prev is None or not is_stale(element, prev):
+                        pending[element.id] = element
+                    else:
+                        store.ingest_dropped += 1
+                revisions[store] = revision
+            for (store, mode), pending in merged.items():
+                try:
+                    self.apply(store, pending.values(), mode)
+                except Exception as e:
+                    # Keep the applier alive; the batch is still acknowledged
+                    print('ingest: failed to apply batch: ' + str(e))
+            for store, revision in revisions.items():
+                with store.ingest_applied_cond:
+                    store.ingest_applied = revision
+                    store.ingest_applied_cond.notify_all()
+            elapsed = (time.perf_counter() - start) / len(batches)
+            self.apply_seconds = 0.8 * self.apply_seconds + 0.2 * elapsed
+
+    @staticmethod
+    def apply(store, elem_list, mode):
+        with store.lock:
+            fresh = []
+            for element in elem_list:
+                orig = store.elements.get(element.id)
+                if orig is not None and is_stale(element, orig):
+                    store.ingest_dropped += 1
+                else:
+                    fresh.append(element)
+            put_elements(store, fresh, mode)
+
+
+ingest = IngestQueue(INGEST_QUEUE_SIZE)
+
+# End-state file (JSON array or NDJSON, optionally .gz) loaded into the default
+# namespace at startup; also settable with --preload when run as a script
+PRELOAD = os.environ.get('RPE021_PRELOAD')
+
+
+class Preloader:
+    """Loads an end-state file straight into an element store in a background
+    thread, so the server can answer readiness probes while it loads.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.done = threading.Event()
+        self.count = 0
+        self.seconds = 0.0
+        self.error = None
+
+    def start(self, path, store):
+        self.path = path
+        if not path:
+            self.done.set()
+            return
+        threading.Thread(target=self.run, args=(store,), daemon=True, name='preload').start()
+
+    def run(self, store):
+        start = time.perf_counter()
+        try:
+            elements = [load_element(data) for data in rpe021_stream.read_elements(self.path)]
+            store.load(elements)
+            self.count = len(elements)
+            # The loaded elements live as long as the server, so move them out
+            # of the collector's generations rather than rescanning them in
+            # every full collection
+            gc.freeze()
+        except Exception as e:
+            self.error = '%s: %s' % (type(e).__name__, e)
+            print('preload: failed to load %s: %s' % (self.path, self.error))
+        self.seconds = time.perf_counter() - start
+        if self.error is None:
+            print('preload: loaded %d elements from %s in %.2fs' % (self.count, self.path, self.seconds))
+        self.done.set()
+
+
+preloader = Preloader()
+
+
+@app.on_event('startup')
+def start_preload():
+    preloader.start(PRELOAD, stores.get(DEFAULT_NAMESPACE))
+
+
+class NamespaceMiddleware:
+    """ASGI middleware that maps the /ns/<name>/... path prefix onto the
+    namespace header, so both ways of selecting a namespace reach the same
+    handlers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'].startswith('/ns/'):
+            name, _, path = scope['path'][4:].partition('/')
+            scope = dict(scope)
+            scope['path'] = '/' + path
+            scope['raw_path'] = scope['path'].encode()
+            scope['headers'] = [(k, v) for k, v in scope['headers'] if k != NAMESPACE_HEADER.encode()]
+            scope['headers'].append((NAMESPACE_HEADER.encode(), name.encode()))
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(NamespaceMiddleware)
+
+
+def namespace_of(x_rpe21_namespace):
+    """Return the namespace selected by a request, or 400 if it is invalid."""
+    # Only a missing header means the default namespace; an empty name (e.g.
+    # /ns//elements) is a mistake that must not reach the shared store
+    name = DEFAULT_NAMESPACE if x_rpe21_namespace is None else x_rpe21_namespace
+    if not NAMESPACE_PATTERN.match(name):
+        raise HTTPException(status_code=400, detail='Invalid namespace')
+    return name
+
+
+def get_store(x_rpe21_namespace: Optional[str] = Header(None)):
+    """Dependency resolving the element store of a request's namespace,
+    creating the namespace if needed.
+    """
+    return stores.get(namespace_of(x_rpe21_namespace))
+
+
+def find_store(x_rpe21_namespace: Optional[str] = Header(None)):
+    """Dependency resolving the element store of a request's namespace for
+    requests that can't add elements, which leave a missing namespace missing
+    (and see it as empty).
+    """
+    return stores.get(namespace_of(x_rpe21_namespace), create=False)
+
+
+# Element fields that filter-scoped mutations can match on
+FILTER_FIELDS = ('id', 'label', 'color', 'data', 'elem_type', 'cidr_block', 'endpoint_type',
+    'os_type', 'network', 'interface_from', 'interface_to', 'line_type')
+
+# Filter-scoped deletes remove elements in this order, so that elements
+# deleted together never count as orphaning each other
+DELETE_ORDER = {'connection': 0, 'endpoint': 1, 'network': 2}
+
+
+def merge_patch(target, patch):
+    """Apply a JSON merge patch (RFC 7386) to decoded JSON data."""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def patch_element(store, id, patch, mode):
+    """Merge-patch a stored element, returning the new element. Raises a 404
+    if it doesn't exist, 400 if the result isn't a valid element, and 409 if
+    it conflicts with the integrity mode.
+    """
+    with store.lock:
+        orig = store.find(id)
+        if not isinstance(patch, dict) or patch.get('id', id) != id:
+            raise HTTPException(status_code=400, detail='Invalid patch')
+        try:
+            element = Element.parse_obj(merge_patch(orig.dict(), patch))
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if mode == 'strict' and store.refs.unresolved(element):
+            raise HTTPException(status_code=409, detail='Element references missing elements')
+        store.put(element, mode)
+        return element
+
+
+def filter_elements(store, request):
+    """Return the stored elements matching a request's field=value query
+    parameters, or 400 if there are none or they name unknown fields.
+    """
+    filters = {key: value for key, value in request.query_params.items() if key != 'integrity'}
+    if not filters:
+        raise HTTPException(status_code=400, detail='No filter given')
+    for key in filters:
+        if key not in FILTER_FIELDS:
+            raise HTTPException(status_code=400, detail='Invalid filter field "%s"' % (key,))
+    # Use the reference index to narrow down the candidates if possible
+    if 'network' in filters:
+        ids = {id for id, field in store.refs.referrers.get(('network', filters['network']), ())}
+    elif 'interface_from' in filters or 'interface_to' in filters:
+        field = 'interface_from' if 'interface_from' in filters else 'interface_to'
+        ids = {id for id, f in store.refs.referrers.get(('interface', filters[field]), ()) if f == field}
+    elif 'id' in filters:
+        ids = {filters['id']}
+    else:
+        ids = store.elements.keys()
+    matches = []
+    for id in list(ids):
+        element = store.elements.get(id)
+        if element is not None and all(getattr(element, key) == value for key, value in filters.items()):
+            matches.append(element)
+    return matches
+
+
+def check_integrity_mode(mode):
+    """Resolve the integrity mode of a request, or 400 if it is invalid."""
+    mode = mode or INTEGRITY_MODE
+    if mode not in INTEGRITY_MODES:
+        raise HTTPException(status_code=400, detail='Invalid integrity mode')
+    return mode
+
+
 @app.get('/elements')
-def get_all_elements():
-    """Return a list of all elements."""
-    elem_list = []
-    for key, elem in elements.items():
-        elem_list.append(elem)
+def get_all_elements(response: Response, since: Optional[str] = None,
+        if_none_match: Optional[str] = Header(None), store: ElementStore = Depends(find_store)):
+    """Return a list of all elements, or 304 if If-None-Match has the current
+    ETag.
+
+    Given the ETag of an earlier response as since, only the elements changed
+    since then are returned, along with the IDs deleted since then. If the
+    server can't tell (e.g. too many deletions ago), all elements are returned
+    and "deleted" is left out.
+    """
+    with store.lock:
+        etag = store.etag()
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={'ETag': etag})
+        delta = store.changed_since(since) if since else None
+        if delta is None:
+            elem_list = []
+            for key, elem in store.elements.items():
+                elem_list.append(elem)
+    response.headers['ETag'] = etag
+    if delta is not None:
+        return {'elements': delta[0], 'deleted': delta[1]}
     return {'elements': elem_list}
 
 @app.post('/elements', status_code=201)
-def add_element(elem_list: List[Element]):
-    """Add or update a list of elements."""
+def add_element(elem_list: List[Element], response: Response, integrity: Optional[str] = None,
+        prefer: Optional[str] = Header(None), store: ElementStore = Depends(get_store)):
+    """Add or update a list of elements.
+
+    With "Prefer: respond-async" the list is queued for the ingest applier
+    instead, and 202 is returned with the ingest revision to wait for (see
+    GET /ingest), or 429 if the queue is full.
+    """
+    mode = check_integrity_mode(integrity)
+    if prefer and 'respond-async' in prefer.lower():
+        revision = ingest.submit(store, elem_list, mode)
+        response.status_code = 202
+        return {'revision': revision}
     print('elements: ' + str(elem_list))
-    response = {}
+    result = {}
     anySuccess = False
-    for element in elem_list:
-        id = element.id
-        # NOTE: Older API version only allowed new elements and rejected
-        # changes to existing elements
-        elements[id] = element
-        response[id] = "/element/" + id
+    for id in put_elements(store, elem_list, mode):
+        result[id] = "/element/" + id
         anySuccess = True
     
     if anySuccess:
-        return response
+        return result
     else:
-        raise HTTPException(status_code=403, detail=str(response))
+        raise HTTPException(status_code=403, detail=str(result))
 
 @app.delete('/elements')
-def delete_all_elements():
-    """Delete all elements."""
-    elements.clear()
+def delete_all_elements(store: ElementStore = Depends(find_store)):
+    """Delete all elements (of the request's namespace only). Namespaces other
+    than the default are then dropped, and recreated empty on next use.
+    """
+    store.clear()
+    stores.drop(store)
     # NOTE: Output is not significant, just the HTTP response code (200)
     return {'elements': []}
 
 @app.get('/image', response_class=Response)
-def get_image():
-    """Return the current visualization as a static image file."""
+def get_image(width: int = 1024, height: int = 768, networks: Optional[str] = None,
+        elem_types: Optional[str] = None, bbox: Optional[str] = None, lod: str = 'auto',
+        store: ElementStore = Depends(find_store)):
+    """Return the current visualization as a static image file.
+
+    The image can be scoped to a viewport: its size in pixels, a comma-separated
+    subset of networks and/or elem_types, a bbox "x0,y0,x1,y1" in /layout
+    coordinates, and a level of detail (lod) of auto, full or aggregate.
+    """
     # This script just demonstrates the REST API - great visualizations are
     # the job of our participants!
-    return Response(content="not-a-png-file", media_type="image/png", status_code=200)
+    if store.layout is None:
+        return Response(content="not-a-png-file", media_type="image/png", status_code=200)
+    if not (16 <= width <= 4096 and 16 <= height <= 4096):
+        raise HTTPException(status_code=400, detail='Invalid image size')
+    if lod not in rpe021_render.LODS:
+        raise HTTPException(status_code=400, detail='Invalid level of detail')
+    if bbox is not None:
+        try:
+            bbox = [float(v) for v in bbox.split(',')]
+        except ValueError:
+            bbox = None
+        # Its corners and size must be finite (e.g. not inf, nan or 2e308)
+        if bbox is None or len(bbox) != 4 or bbox[0] >= bbox[2] or bbox[1] >= bbox[3] or \
+                not all(math.isfinite(v) for v in bbox + [bbox[2] - bbox[0], bbox[3] - bbox[1]]):
+            raise HTTPException(status_code=400, detail='Invalid bounding box')
+    current = store.layout.compute(store.elements)
+    colors = store.layout.colors_of(current)
+    png = rpe021_render.render_png(current, colors, width, height,
+        networks=networks.split(',') if networks else None,
+        elem_types=elem_types.split(',') if elem_types else None, bbox=bbox, lod=lod)
+    return Response(content=png, media_type="image/png", status_code=200)
 
 @app.get('/element/{id}')
-def get_element(id: str):
-    """Return a single element, or 404 if ID is not found."""
-    element = find_element(id)
+def get_element(id: str, response: Response, if_none_match: Optional[str] = Header(None),
+        store: ElementStore = Depends(find_store)):
+    """Return a single element, or 404 if ID is not found, or 304 if
+    If-None-Match has its current ETag.
+    """
+    with store.lock:
+        element = store.find(id)
+        etag = store.etag(id)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={'ETag': etag})
+    response.headers['ETag'] = etag
     return element
 
 @app.post('/element', status_code=201)
-def add_element(element: Element):
+def add_element(element: Element, integrity: Optional[str] = None,
+        store: ElementStore = Depends(get_store)):
     """Add a single element, or 400 if ID already exists."""
     #print('element: ' + str(element))
+    mode = check_integrity_mode(integrity)
     id = element.id
-    if id not in elements:
-        elements[id] = element
-        return {id: "/element/" + id}
-    else:
-        raise HTTPException(status_code=400, detail='Element ID already exists')
+    with store.lock:
+        if id in store.elements:
+            raise HTTPException(status_code=400, detail='Element ID already exists')
+        if mode == 'strict' and store.refs.unresolved(element):
+            raise HTTPException(status_code=409, detail='Element references missing elements')
+        store.put(element, mode)
+    return {id: "/element/" + id}
 
 @app.put('/element/{id}')
-def update_element(element: Element):
+def update_element(element: Element, integrity: Optional[str] = None,
+        store: ElementStore = Depends(find_store)):
     """Update an existing element, or 404 if ID is not found."""
+    mode = check_integrity_mode(integrity)
     id = element.id
-    origElement = find_element(id)
-    elements[id] = element
+    with store.lock:
+        origElement = store.find(id)
+        if mode == 'strict' and store.refs.unresolved(element):
+            raise HTTPException(status_code=409, detail='Element references missing elements')
+        store.put(element, mode)
     # NOTE: Output is not significant, just the HTTP response code (200/4xx)
     return {"orig_element": origElement, "new_element": element}
 
 @app.delete('/element/{id}')
-def delete_element(id: str):
+def delete_element(id: str, integrity: Optional[str] = None,
+        store: ElementStore = Depends(find_store)):
     """Delete an existing element, or 404 if ID is not found."""
-    element = find_element(id)
-    del elements[id]
+    mode = check_integrity_mode(integrity)
+    with store.lock:
+        element = store.find(id)
+        store.remove(id, mode)
     # NOTE: Output is not significant, just the HTTP response code (200/404)
     return element
 
-def find_element(id: str):
-    """Helper function to look up an element by ID or throw a HTTP 404 response."""
-    if id in elements:
-        return elements[id]
+@app.patch('/element/{id}')
+def patch_element_by_id(id: str, patch: dict = Body(...), integrity: Optional[str] = None,
+        store: ElementStore = Depends(find_store)):
+    """Apply a JSON merge patch to an existing element, or 404 if ID is not
+    found. Only the changed fields need to be sent, e.g. {"color": "red"}.
+    """
+    mode = check_integrity_mode(integrity)
+    return patch_element(store, id, patch, mode)
+
+@app.patch('/elements')
+def patch_elements(patches: Dict[str, dict], integrity: Optional[str] = None,
+        store: ElementStore = Depends(find_store)):
+    """Apply JSON merge patches to several elements, given a map of element ID
+    to patch. Elements that don't exist or can't be patched are skipped; 404
+    if none could be patched.
+    """
+    mode = check_integrity_mode(integrity)
+    response = {}
+    for id, patch in patches.items():
+        try:
+            patch_element(store, id, patch, mode)
+        except HTTPException:
+            continue
+        response[id] = "/element/" + id
+    if response:
+        return response
+    else:
+        raise HTTPException(status_code=404, detail='No elements patched')
+
+@app.patch('/elements/filter')
+def patch_filtered_elements(request: Request, patch=Body(...), integrity: Optional[str] = None,
+        store: ElementStore = Depends(find_store)):
+    """Apply a JSON merge patch to every element matching the field=value
+    query parameters, e.g. PATCH /elements/filter?network=dmz_1 {"color": "red"}.
+    Returns 400 if the patch isn't an object or changes IDs, and 404 if no
+    elements were patched.
+    """
+    mode = check_integrity_mode(integrity)
+    # A patch that touches the ID could never apply to more than one element
+    if not isinstance(patch, dict) or 'id' in patch:
+        raise HTTPException(status_code=400, detail='Invalid patch')
+    response = {}
+    with store.lock:
+        for element in filter_elements(store, request):
+            try:
+                patch_element(store, element.id, patch, mode)
+            except HTTPException:
+                continue
+            response[element.id] = "/element/" + element.id
+    if response:
+        return response
     else:
-        raise HTTPException(status_code=404, detail='Element ID not found')
+        raise HTTPException(status_code=404, detail='No elements patched')
+
+@app.delete('/elements/filter')
+def delete_filtered_elements(request: Request, integrity: Optional[str] = None,
+        store: ElementStore = Depends(find_store)):
+    """Delete every element matching the field=value query parameters, e.g.
+    DELETE /elements/filter?elem_type=connection&line_type=dashed.
+    """
+    mode = check_integrity_mode(integrity)
+    deleted = []
+    with store.lock:
+        matches = filter_elements(store, request)
+        matches.sort(key=lambda element: DELETE_ORDER.get(element.elem_type, 0))
+        for element in matches:
+            try:
+                if store.remove(element.id, mode) is not None:
+                    deleted.append(element.id)
+            except HTTPException:
+                continue
+    return {'deleted': deleted}
+
+@app.get('/integrity')
+def get_integrity(store: ElementStore = Depends(find_store)):
+    """Return the current set of dangling references."""
+    refs = store.refs
+    with store.lock:
+        dangling = [{'id': id, 'field': field, 'target': target[1], 'refcount': refs.refcount(target)}
+            for id, field, target in sorted(refs.dangling)]
+    return {'mode': INTEGRITY_MODE, 'dangling': dangling}
+
+@app.get('/layout')
+def get_layout(iterations: int = 0, store: ElementStore = Depends(find_store)):
+    """Return node positions for networks and endpoints, and end points for
+    connections (omitted if either end is dangling). The layout is only
+    recomputed when the graph structure changes; pass iterations to relax it
+    further.
+    """
+    if store.layout is None:
+        raise HTTPException(status_code=501, detail='Layout requires NumPy')
+    if iterations < 0 or iterations > 1000:
+        raise HTTPException(status_code=400, detail='Invalid number of iterations')
+    current = store.layout.compute(store.elements, iterations)
+    pos = current.pos.round(3).tolist()
+    nodes = dict(zip(current.ids, pos))
+    connections = {}
+    for id, (a, b) in zip(current.conn_ids, current.conn_rows.tolist()):
+        if a >= 0 and b >= 0:
+            connections[id] = pos[a] + pos[b]
+    bbox = current.pos.min(axis=0).tolist() + current.pos.max(axis=0).tolist() if len(pos) else None
+    return {'nodes': nodes, 'connections': connections, 'bbox': bbox}
+
+@app.get('/ingest')
+def get_ingest(revision: int = 0, timeout: float = 0.0, store: ElementStore = Depends(find_store)):
+    """Return the latest ingest revision accepted and applied. If a revision
+    is given, first wait up to timeout seconds (at most 30) for it to be
+    applied.
+    """
+    with store.ingest_applied_cond:
+        if revision > store.ingest_applied and timeout > 0:
+            store.ingest_applied_cond.wait_for(lambda: store.ingest_applied >= revision, min(timeout, 30.0))
+        return {'accepted': store.ingest_accepted, 'applied': store.ingest_applied,
+            'dropped': store.ingest_dropped, 'queued': ingest.queue.qsize()}
+
+@app.get('/namespaces')
+def get_namespaces():
+    """Return the size, revision and idle time of every namespace."""
+    now = time.monotonic()
+    with stores.lock:
+        namespaces = {name: {'elements': len(store.elements), 'revision': store.revision,
+            'idle_seconds': round(now - store.last_access, 1)} for name, store in stores.stores.items()}
+    return {'namespaces': namespaces}
+
+@app.get('/ready')
+def get_ready():
+    """Readiness probe: 503 until the preloaded end state (if any) has been
+    loaded, or if it failed to load.
+    """
+    if not preloader.done.is_set():
+        raise HTTPException(status_code=503, detail='Loading %s' % (preloader.path,))
+    if preloader.error is not None:
+        raise HTTPException(status_code=503, detail='Failed to load %s: %s' % (preloader.path, preloader.error))
+    return {'ready': True, 'preloaded': preloader.count, 'load_seconds': round(preloader.seconds, 3)}
+
+
+if __name__ == '__main__':
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description='Example RPE-021 REST API')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on')
+    parser.add_argument('--preload', default=PRELOAD, help='end-state file to load at startup')
+    args = parser.parse_args()
+    PRELOAD = args.preload
+    uvicorn.run(app, host=args.host, port=args.port)
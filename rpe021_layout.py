@@ -0,0 +1,325 @@
+"""
+Incremental force-directed layout for RPE-021 element stores, vectorized with
+NumPy. Networks and endpoints are laid out as nodes; each endpoint is tied to
+its network by a spring, so networks act as cluster centers, and connections
+are drawn between the endpoints that own their interfaces.
+
+Repulsion between all nodes is approximated on a grid: node masses are
+deposited on a G x G mesh and convolved with the 1/r force kernel via FFT
+(the particle-mesh method), and nodes sharing a grid cell also repel each
+other directly. One iteration therefore costs O(N + E + G^2 log G) rather
+than O(N^2).
+
+The engine is fed every mutation of the element store but only re-lays out
+when the graph structure changes (elements added/removed, network or
+interface membership changed). Recoloring or relabeling never triggers a
+layout, and structural changes warm-start from the previous positions, with
+more relaxation (up to a full cold start) the more nodes are new or moved.
+
+Copyright 2022-2023, Maryland Innovation and Security Institute
+"""
+
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+# Node kinds, as stored in Layout.kinds
+NETWORK = 0
+ENDPOINT = 1
+
+# Snapshot of a computed layout. Node i has ID ids[i], position pos[i] and
+# kind kinds[i]; cluster[i] is the row of its network (-1 if none, or if the
+# node is itself a network). Connection j has ID conn_ids[j] and joins the
+# node rows conn_rows[j].
+Layout = namedtuple('Layout', ['ids', 'index', 'pos', 'kinds', 'cluster', 'conn_ids', 'conn_rows'])
+
+
+def structure_of(element):
+    """Return the parts of an element that affect the layout."""
+    if element.elem_type == 'endpoint':
+        ifaces = tuple(iface.interface_id for iface in element.interfaces or ())
+        return ('endpoint', element.network, ifaces)
+    if element.elem_type == 'connection':
+        return ('connection', element.interface_from, element.interface_to)
+    return (element.elem_type,)
+
+
+class LayoutEngine:
+    """Lays out an element store, reusing previous positions when it changes."""
+
+    # Spring strengths for endpoint->network and connection edges
+    MEMBER_WEIGHT = 1.0
+    CONNECTION_WEIGHT = 0.5
+    # Pull towards the origin, keeping disconnected clusters together
+    GRAVITY = 0.05
+    # Same-cell neighbours (in grid order) each node repels directly
+    NEAR_NEIGHBOURS = 8
+    # Share of new or moved nodes from which a re-layout starts cold
+    COLD_FRACTION = 0.25
+
+    def __init__(self, iterations=150, warm_iterations=15, seed=0):
+        self.iterations = iterations
+        self.warm_iterations = warm_iterations
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.structure = {}  # element ID -> structure_of(element)
+        self.layout = None
+        self.dirty = False
+        self.kernels = {}  # grid size -> FFT of the force kernels
+        # Colors are tracked for renderers, separately from the structure
+        self.colors = {}  # element ID -> color
+        self.color_version = 0
+        self.color_cache = None
+
+    def update(self, element):
+        """Record an added or changed element."""
+        structure = structure_of(element)
+        if self.structure.get(element.id) != structure:
+            self.structure[element.id] = structure
+            self.dirty = True
+        if self.colors.get(element.id) != element.color:
+            self.colors[element.id] = element.color
+            self.color_version += 1
+
+    def remove(self, id):
+        """Record a deleted element."""
+        if self.structure.pop(id, None) is not None:
+            self.dirty = True
+        if self.colors.pop(id, None) is not None:
+            self.color_version += 1
+
+    def clear(self):
+        self.structure.clear()
+        self.layout = None
+        self.dirty = False
+        self.colors.clear()
+        self.color_version += 1
+
+    def colors_of(self, layout):
+        """Return the colors of a layout's nodes and connections as a list of
+        color names and two arrays of indexes into it. The result is cached
+        until an element is recolored or the layout changes.
+        """
+        with self.lock:
+            cached = self.color_cache
+            if cached is not None and cached[0] is layout and cached[1] == self.color_version:
+                return cached[2]
+            names = []
+            lookup = {}
+
+            def color_index(id):
+                color = self.colors.get(id)
+                if color not in lookup:
+                    lookup[color] = len(names)
+                    names.append(color)
+                return lookup[color]
+
+            nodes = np.array([color_index(id) for id in layout.ids], dtype=np.intp)
+            conns = np.array([color_index(id) for id in layout.conn_ids], dtype=np.intp)
+            self.color_cache = (layout, self.color_version, (names, nodes, conns))
+            return self.color_cache[2]
+
+    def compute(self, elements, iterations=0):
+        """Return the current Layout of the elements, relaxing it first if
+        the structure changed (plus any extra iterations requested).
+        """
+        with self.lock:
+            if self.dirty or self.layout is None:
+                self.dirty = False
+                self.layout, placed = self._rebuild(elements)
+                # Scale from a warm start towards a cold one with the share of
+                # nodes placed anew, e.g. when a nearly empty store fills up
+                heat = min(placed / self.COLD_FRACTION, 1.0)
+                iterations += int(round(self.warm_iterations +
+                    (self.iterations - self.warm_iterations) * heat))
+            else:
+                heat = 0.0
+            if iterations:
+                self._relax(self.layout, iterations, heat)
+            return self.layout
+
+    def _rebuild(self, elements):
+        """Build the node/edge arrays for the elements, carrying over the
+        positions of nodes that were already laid out. Returns the Layout and
+        the share of its nodes that had to be placed anew.
+        """
+        ids = []
+        kinds = []
+        networks = []
+        iface_owner = {}
+        conn_ids = []
+        conn_ifaces = []
+        for elem in list(elements.values()):
+            if elem.elem_type == 'network':
+                ids.append(elem.id)
+                kinds.append(NETWORK)
+                networks.append(None)
+            elif elem.elem_type == 'endpoint':
+                row = len(ids)
+                ids.append(elem.id)
+                kinds.append(ENDPOINT)
+                networks.append(elem.network)
+                for iface in elem.interfaces or ():
+                    iface_owner[iface.interface_id] = row
+            elif elem.elem_type == 'connection':
+                conn_ids.append(elem.id)
+                conn_ifaces.append((elem.interface_from, elem.interface_to))
+        index = {id: row for row, id in enumerate(ids)}
+
+        kinds = np.array(kinds, dtype=np.int8)
+        # Only networks are cluster centers; an endpoint whose network names
+        # a missing element, or one that isn't a network, has no cluster
+        cluster = np.array([index.get(net, -1) if net is not None else -1 for net in networks],
+            dtype=np.intp)
+        if len(cluster):
+            cluster[kinds[cluster] != NETWORK] = -1
+        # Connections with a dangling end have no position
+        conn_rows = np.array([(iface_owner.get(a, -1), iface_owner.get(b, -1)) for a, b in conn_ifaces],
+            dtype=np.intp).reshape(-1, 2)
+
+        pos, placed = self._initial_positions(ids, cluster)
+        return Layout(ids, index, pos, kinds, cluster, conn_ids, conn_rows), placed
+
+    def _initial_positions(self, ids, cluster):
+        """Return the starting positions of the nodes, and the share of them
+        that are new or have moved to another network and so were placed anew.
+        """
+        n = len(ids)
+        pos = np.full((n, 2), np.nan)
+        old = self.layout
+        if old is not None:
+            rows = [(row, old.index[id]) for row, id in enumerate(ids) if id in old.index]
+            if rows:
+                new_rows, old_rows = np.array(rows).T
+                # Keep the position of a node unless its network changed
+                # (a removed network counts as unchanged)
+                renumber = np.full(len(old.ids), -1, dtype=np.intp)
+                renumber[old_rows] = new_rows
+                old_cluster = old.cluster[old_rows]
+                kept = np.where(old_cluster >= 0, renumber[old_cluster], -1) == cluster[new_rows]
+                pos[new_rows[kept]] = old.pos[old_rows[kept]]
+        missing = np.isnan(pos[:, 0])
+        if not missing.any():
+            return pos, 0.0
+
+        # Place new networks anywhere in the current extent, then new
+        # endpoints close to their (possibly new) network
+        radius = max(np.sqrt(n), 1.0)
+        if (~missing).any():
+            radius = max(radius, np.abs(pos[~missing]).max())
+        new_nets = missing & (cluster < 0)
+        pos[new_nets] = self.rng.uniform(-radius, radius, (int(new_nets.sum()), 2))
+        # Clusters are networks, so they now all have a position; still,
+        # never place a member relative to a position that isn't set
+        new_members = missing & (cluster >= 0)
+        new_members[new_members] = np.isfinite(pos[cluster[new_members], 0])
+        loose = missing & (cluster >= 0) & ~new_members
+        pos[loose] = self.rng.uniform(-radius, radius, (int(loose.sum()), 2))
+        if new_members.any():
+            members = np.bincount(cluster[cluster >= 0], minlength=n)
+            spread = np.sqrt(members[cluster[new_members]])[:, None]
+            pos[new_members] = pos[cluster[new_members]] + \
+                self.rng.normal(0.0, 1.0, (int(new_members.sum()), 2)) * spread
+        return pos, missing.sum() / n
+
+    def _relax(self, layout, iterations, heat):
+        """Run force-directed iterations on the layout positions in place,
+        starting from a temperature between a warm (heat 0) and cold (heat 1)
+        start.
+        """
+        pos = layout.pos
+        n = len(pos)
+        if n < 2:
+            pos[:] = 0.0
+            return
+
+        # Networks are heavier so that clusters push each other apart
+        mass = np.ones(n)
+        has_net = layout.cluster >= 0
+        members = np.bincount(layout.cluster[has_net], minlength=n)
+        mass[layout.kinds == NETWORK] += np.sqrt(members[layout.kinds == NETWORK])
+
+        member_edges = np.stack([np.nonzero(has_net)[0], layout.cluster[has_net]], axis=1)
+        conn = layout.conn_rows
+        conn = conn[(conn[:, 0] >= 0) & (conn[:, 1] >= 0) & (conn[:, 0] != conn[:, 1])]
+        edges = np.concatenate([member_edges, conn])
+        weights = np.concatenate([np.full(len(member_edges), self.MEMBER_WEIGHT),
+            np.full(len(conn), self.CONNECTION_WEIGHT)])
+
+        # Temperature (maximum step) cools linearly; warm starts begin cool
+        # since the existing layout only needs local adjustment
+        start = 1.0 + (np.sqrt(n) * 0.1 - 1.0) * heat
+        for t in np.linspace(start, 0.05, iterations):
+            disp = self._repulsion(pos, mass)
+            disp += self._attraction(pos, edges, weights)
+            disp -= self.GRAVITY * mass[:, None] * pos
+            length = np.sqrt((disp ** 2).sum(axis=1))
+            scale = np.minimum(length, t) / np.maximum(length, 1e-9)
+            pos += disp * scale[:, None]
+
+    @staticmethod
+    def _grid_size(n):
+        return int(min(256, max(16, 2 ** np.ceil(np.log2(np.sqrt(n) * 2)))))
+
+    def _kernel(self, size):
+        """Return the FFTs of the x/y repulsion kernels d/|d|^2 for a size x
+        size grid, zero-padded for linear (non-periodic) convolution.
+        """
+        if size not in self.kernels:
+            offsets = np.fft.fftfreq(2 * size, 1.0 / (2 * size))
+            dx, dy = np.meshgrid(offsets, offsets, indexing='ij')
+            dist2 = dx ** 2 + dy ** 2
+            dist2[0, 0] = np.inf
+            self.kernels[size] = (np.fft.rfft2(dx / dist2), np.fft.rfft2(dy / dist2))
+        return self.kernels[size]
+
+    def _repulsion(self, pos, mass):
+        """Approximate the repulsive force on every node: particle-mesh for
+        nodes in different grid cells, direct for nodes sharing a cell.
+        """
+        n = len(pos)
+        size = self._grid_size(n)
+        low = pos.min(axis=0)
+        cell = max((pos.max(axis=0) - low).max() / (size - 1), 1e-6)
+        grid = np.clip(np.rint((pos - low) / cell).astype(np.intp), 0, size - 1)
+        flat = grid[:, 0] * size + grid[:, 1]
+
+        density = np.bincount(flat, weights=mass, minlength=size * size).reshape(size, size)
+        kx, ky = self._kernel(size)
+        density = np.fft.rfft2(density, s=(2 * size, 2 * size))
+        fx = np.fft.irfft2(density * kx, s=(2 * size, 2 * size))[:size, :size]
+        fy = np.fft.irfft2(density * ky, s=(2 * size, 2 * size))[:size, :size]
+        disp = np.stack([fx.ravel()[flat], fy.ravel()[flat]], axis=1) * (mass / cell)[:, None]
+
+        order = np.argsort(flat, kind='stable')
+        for shift in range(1, min(self.NEAR_NEIGHBOURS, n - 1) + 1):
+            a = order[:-shift]
+            b = order[shift:]
+            same = flat[a] == flat[b]
+            a = a[same]
+            b = b[same]
+            if not len(a):
+                break
+            delta = pos[a] - pos[b]
+            dist2 = (delta ** 2).sum(axis=1) + 1e-4
+            force = delta * (mass[a] * mass[b] / dist2)[:, None]
+            disp[:, 0] += np.bincount(a, force[:, 0], n) - np.bincount(b, force[:, 0], n)
+            disp[:, 1] += np.bincount(a, force[:, 1], n) - np.bincount(b, force[:, 1], n)
+        return disp
+
+    @staticmethod
+    def _attraction(pos, edges, weights):
+        """Return the spring forces pulling connected nodes together."""
+        n = len(pos)
+        disp = np.zeros((n, 2))
+        if not len(edges):
+            return disp
+        a = edges[:, 0]
+        b = edges[:, 1]
+        delta = pos[b] - pos[a]
+        dist = np.sqrt((delta ** 2).sum(axis=1))
+        force = delta * (weights * dist)[:, None]
+        disp[:, 0] = np.bincount(a, force[:, 0], n) - np.bincount(b, force[:, 0], n)
+        disp[:, 1] = np.bincount(a, force[:, 1], n) - np.bincount(b, force[:, 1], n)
+        return disp
@@ -0,0 +1,224 @@
+"""
+Rasterizes an RPE-021 layout (see rpe021_layout.py) into a PNG image with
+NumPy, scoped to a viewport: only the requested subset of networks/element
+types inside the bounding box is drawn, at the requested output size.
+
+At low zoom, drawing every endpoint of a dense network is both slow and
+unreadable, so each network is collapsed into a single aggregate glyph sized
+by its number of endpoints and colored by the most severe color among them,
+and connections are drawn between networks instead of endpoints.
+
+Copyright 2022-2023, Maryland Innovation and Security Institute
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+from rpe021_layout import NETWORK, ENDPOINT
+
+# RGB values for the color names used by RPE-021 data; anything else that
+# isn't a #rrggbb value is drawn gray
+PALETTE = {
+    'red': (220, 40, 40),
+    'orange': (245, 140, 20),
+    'yellow': (230, 200, 20),
+    'green': (40, 160, 60),
+    'blue': (40, 90, 220),
+    'purple': (140, 60, 190),
+    'black': (0, 0, 0),
+    'white': (255, 255, 255),
+    'gray': (128, 128, 128),
+    'grey': (128, 128, 128),
+}
+DEFAULT_RGB = (128, 128, 128)
+BACKGROUND = (255, 255, 255)
+
+# Aggregate glyphs take the color of their most severe endpoint
+SEVERITY = {'red': 5, 'orange': 4, 'yellow': 3, 'purple': 2, 'blue': 1}
+
+LODS = ('auto', 'full', 'aggregate')
+
+# In auto LOD, networks are aggregated below this many pixels per layout unit
+# (endpoints are laid out about one unit apart)
+AGGREGATE_SCALE = 3.0
+
+
+def rgb_of(name):
+    """Return the RGB value of a color name or #rrggbb string."""
+    if name is None:
+        return DEFAULT_RGB
+    name = name.strip().lower()
+    if name in PALETTE:
+        return PALETTE[name]
+    if len(name) == 7 and name.startswith('#'):
+        try:
+            return tuple(int(name[i:i + 2], 16) for i in (1, 3, 5))
+        except ValueError:
+            pass
+    return DEFAULT_RGB
+
+
+def encode_png(image):
+    """Encode an (H, W, 3) uint8 array as a PNG file."""
+    height, width, _ = image.shape
+    raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)  # filter byte 0 per row
+    raw[:, 1:] = image.reshape(height, width * 3)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + \
+            struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + \
+        chunk(b'IDAT', zlib.compress(raw.tobytes(), 3)) + chunk(b'IEND', b'')
+
+
+def draw_lines(image, start, end, rgb):
+    """Draw line segments (pixel coordinates) clipped to the image."""
+    if not len(start):
+        return
+    height, width, _ = image.shape
+    delta = (end - start).astype(np.float32)
+    samples = np.minimum(np.ceil(np.abs(delta).max(axis=1)), max(height, width) * 2).astype(np.intp) + 1
+    seg = np.repeat(np.arange(len(start)), samples)
+    # Position of each sample along its segment, from 0 to 1
+    offsets = np.arange(len(seg), dtype=np.float32) - np.repeat(np.cumsum(samples) - samples, samples)
+    frac = offsets / np.maximum(samples - 1, 1)[seg]
+    x = (start[seg, 0] + delta[seg, 0] * frac + 0.5).astype(np.intp)
+    y = (start[seg, 1] + delta[seg, 1] * frac + 0.5).astype(np.intp)
+    inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    image[y[inside], x[inside]] = rgb[seg[inside]]
+
+
+def draw_squares(image, centers, radius, rgb):
+    """Draw filled squares of the given pixel radius, clipped to the image."""
+    height, width, _ = image.shape
+    centers = np.rint(centers).astype(np.intp)
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            x = centers[:, 0] + dx
+            y = centers[:, 1] + dy
+            inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+            image[y[inside], x[inside]] = rgb[inside]
+
+
+def draw_discs(image, centers, radii, rgb):
+    """Draw filled discs with per-disc pixel radii, clipped to the image."""
+    height, width, _ = image.shape
+    for (cx, cy), r, color in zip(centers, radii, rgb):
+        x0, x1 = max(int(cx - r), 0), min(int(cx + r) + 1, width)
+        y0, y1 = max(int(cy - r), 0), min(int(cy + r) + 1, height)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        ys, xs = np.ogrid[y0:y1, x0:x1]
+        mask = (xs - cx) ** 2 + (ys - cy) ** 2 <= r * r
+        image[y0:y1, x0:x1][mask] = color
+
+
+def render_png(layout, colors, width, height, networks=None, elem_types=None, bbox=None, lod='auto'):
+    """Render a layout to a PNG image of the given size.
+
+    colors is the (names, node indexes, connection indexes) result of
+    LayoutEngine.colors_of(layout). Only the networks named in networks (and
+    their endpoints) and the elem_types listed are drawn, if given. bbox is
+    the (x0, y0, x1, y1) region of the layout to show; by default the whole
+    visible subset is shown. lod is 'full' to draw every endpoint,
+    'aggregate' to draw each network as one glyph, or 'auto' to aggregate
+    only when endpoints would be too close together to tell apart.
+    """
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = BACKGROUND
+    names, node_colors, conn_colors = colors
+    palette = np.array([rgb_of(name) for name in names] or [DEFAULT_RGB], dtype=np.uint8)
+    severity = np.array([SEVERITY.get((name or '').lower(), 0) for name in names] or [0])
+    types = set(elem_types) if elem_types else {'network', 'endpoint', 'connection'}
+
+    pos = layout.pos
+    n = len(pos)
+    # Select the subset of nodes to draw
+    visible = np.ones(n, dtype=bool)
+    if networks:
+        rows = np.array([layout.index[id] for id in networks
+            if id in layout.index and layout.kinds[layout.index[id]] == NETWORK], dtype=np.intp)
+        selected = np.zeros(n + 1, dtype=bool)
+        selected[rows] = True
+        # Row -1 (no network) maps to the extra False entry
+        visible = selected[:n] | selected[layout.cluster]
+    if not n or not visible.any():
+        return encode_png(image)
+
+    # Fit the bounding box to the image, keeping the aspect ratio
+    if bbox is None:
+        low = pos[visible].min(axis=0)
+        high = pos[visible].max(axis=0)
+        margin = max((high - low).max() * 0.05, 1.0)
+        low = low - margin
+        high = high + margin
+    else:
+        low = np.array(bbox[:2], dtype=float)
+        high = np.array(bbox[2:], dtype=float)
+    span = np.maximum(high - low, 1e-9)
+    scale = min(width / span[0], height / span[1])
+    offset = (np.array([width, height]) - span * scale) / 2.0 - low * scale
+
+    def project(points):
+        return points * scale + offset
+
+    # Cull everything outside the bounding box (plus a glyph's margin)
+    pad = 30.0 / scale
+    in_view = visible & np.all((pos >= low - pad) & (pos <= high + pad), axis=1)
+
+    aggregate = lod == 'aggregate' or (lod == 'auto' and scale < AGGREGATE_SCALE)
+    conn = layout.conn_rows
+    conn_ok = (conn[:, 0] >= 0) & (conn[:, 1] >= 0) if len(conn) else np.zeros(0, dtype=bool)
+
+    if aggregate:
+        # Endpoints move to their network's position (if it has one), and
+        # each network is summarized by its endpoint count and worst color
+        member = layout.cluster >= 0
+        rep = np.where(member, layout.cluster, np.arange(n))
+        counts = np.bincount(rep[visible], minlength=n)
+        worst = np.full(n, -1)
+        node_sev = severity[node_colors]
+        np.maximum.at(worst, rep[visible], node_sev[visible] * len(names) + node_colors[visible])
+
+        if 'connection' in types and len(conn):
+            a = rep[np.where(conn_ok, conn[:, 0], 0)]
+            b = rep[np.where(conn_ok, conn[:, 1], 0)]
+            keep = conn_ok & (a != b) & (visible[conn[:, 0]] | visible[conn[:, 1]])
+            keep &= in_view[a] | in_view[b]
+            pairs, first = np.unique(np.sort(np.stack([a[keep], b[keep]], axis=1), axis=1),
+                axis=0, return_index=True)
+            draw_lines(image, project(pos[pairs[:, 0]]), project(pos[pairs[:, 1]]),
+                palette[conn_colors[keep][first]])
+
+        glyphs = in_view & (counts > 0) & (rep == np.arange(n))
+        if 'network' not in types:
+            glyphs &= layout.kinds != NETWORK
+        if 'endpoint' not in types:
+            glyphs &= layout.kinds == NETWORK
+        rows = np.nonzero(glyphs)[0]
+        # Lone endpoints are small squares, networks discs with an area
+        # proportional to their number of endpoints
+        lone = rows[(layout.kinds[rows] == ENDPOINT)]
+        draw_squares(image, project(pos[lone]), 1, palette[node_colors[lone]])
+        nets = rows[layout.kinds[rows] == NETWORK]
+        radii = np.clip(np.sqrt(counts[nets]) * scale * 0.5, 2.0, 30.0)
+        draw_discs(image, project(pos[nets]), radii, palette[worst[nets] % len(names)])
+        return encode_png(image)
+
+    if 'connection' in types and len(conn):
+        a = np.where(conn_ok, conn[:, 0], 0)
+        b = np.where(conn_ok, conn[:, 1], 0)
+        keep = conn_ok & (visible[a] | visible[b]) & (in_view[a] | in_view[b])
+        draw_lines(image, project(pos[a[keep]]), project(pos[b[keep]]), palette[conn_colors[keep]])
+    radius = 1 if scale < 8 else 2
+    if 'endpoint' in types:
+        rows = np.nonzero(in_view & (layout.kinds == ENDPOINT))[0]
+        draw_squares(image, project(pos[rows]), radius, palette[node_colors[rows]])
+    if 'network' in types:
+        rows = np.nonzero(in_view & (layout.kinds == NETWORK))[0]
+        draw_discs(image, project(pos[rows]), np.full(len(rows), radius * 3.0), palette[node_colors[rows]])
+    return encode_png(image)
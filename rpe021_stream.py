@@ -0,0 +1,114 @@
+"""
+Streaming reader for RPE-021 end-state files. Elements are yielded one at a
+time from a JSON array of elements (as in sample_data), NDJSON (one element
+per line) or a file holding a single element, so that memory use is bounded
+by the size of a single element rather than the whole file. Files ending in
+.gz are decompressed on the fly, and "-" reads standard input.
+
+Copyright 2022-2023, Maryland Innovation and Security Institute
+"""
+
+import gzip
+import json
+import sys
+
+CHUNK_SIZE = 1 << 16
+
+# Guards against buffering the rest of a malformed file
+MAX_ELEMENT_SIZE = 64 << 20
+
+WHITESPACE = ' \t\r\n'
+NUMBER_CHARS = '0123456789.eE+-'
+
+
+def open_elements(path):
+    """Open an end-state file for reading as text."""
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def read_elements(path):
+    """Yield the elements of an end-state file, one at a time."""
+    f = open_elements(path)
+    try:
+        yield from iter_elements(f)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def iter_elements(f, chunk_size=CHUNK_SIZE):
+    """Yield elements one at a time from a text file object containing a JSON
+    array of elements, or a sequence of elements separated by whitespace
+    (NDJSON, or a file holding a single element).
+    """
+    buf, pos, eof = _refill(f, '', 0, chunk_size)
+    buf, pos, eof = _skip_whitespace(f, buf, pos, eof, chunk_size)
+    if pos < len(buf) and buf[pos] == '[':
+        yield from _iter_values(f, buf, pos + 1, eof, chunk_size, True)
+    else:
+        yield from _iter_values(f, buf, pos, eof, chunk_size, False)
+
+
+def _iter_values(f, buf, pos, eof, chunk_size, array):
+    """Decode JSON values from the buffer, reading more of the file as needed.
+    In an array, values must be separated by commas and end with "]";
+    otherwise they are separated by whitespace and end with the file.
+    """
+    decoder = json.JSONDecoder()
+    expect_value = True
+    empty = True
+    while True:
+        buf, pos, eof = _skip_whitespace(f, buf, pos, eof, chunk_size)
+        if pos >= len(buf):
+            if array:
+                raise ValueError('Unterminated JSON array')
+            return
+        if array:
+            if buf[pos] == ']':
+                if expect_value and not empty:
+                    raise ValueError('Expected a value after "," at offset %d of buffer' % (pos,))
+                buf, pos, eof = _skip_whitespace(f, buf, pos + 1, eof, chunk_size)
+                if pos < len(buf):
+                    raise ValueError('Extra data after JSON array at offset %d of buffer' % (pos,))
+                return
+            if buf[pos] == ',' and not expect_value:
+                pos += 1
+                expect_value = True
+                continue
+            if not expect_value:
+                raise ValueError('Expected "," or "]" at offset %d of buffer' % (pos,))
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof or len(buf) - pos > MAX_ELEMENT_SIZE:
+                raise
+            # Most likely the value continues past the end of the buffer
+            buf, pos, eof = _refill(f, buf, pos, chunk_size)
+            continue
+        if not eof and (end == len(buf) or buf[end] in NUMBER_CHARS):
+            # A number at the end of the buffer might continue in the file
+            buf, pos, eof = _refill(f, buf, pos, chunk_size)
+            continue
+        yield value
+        pos = end
+        expect_value = False
+        empty = False
+
+
+def _skip_whitespace(f, buf, pos, eof, chunk_size):
+    while True:
+        while pos < len(buf) and buf[pos] in WHITESPACE:
+            pos += 1
+        if pos < len(buf) or eof:
+            return buf, pos, eof
+        buf, pos, eof = _refill(f, buf, pos, chunk_size)
+
+
+def _refill(f, buf, pos, chunk_size):
+    """Drop the consumed part of the buffer and append the next chunk."""
+    chunk = f.read(chunk_size)
+    return buf[pos:] + chunk, 0, not chunk
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Measures the size and encode/decode CPU cost of the RPE-021 wire formats
+supported by rpe21_client.py, using the end-state files in sample_data:
+    bench_wire_formats.py [file.json ...]
+
+Each file is expanded to the shape returned by GET /elements from the example
+REST API (every optional field present, mostly null) before being encoded.
+
+Copyright 2022-2023, Maryland Innovation and Security Institute
+"""
+
+import glob
+import json
+import os
+import sys
+import time
+import rpe21_client
+
+# All element/interface fields, as serialized by the example REST API
+ELEMENT_FIELDS = ["id", "timestamp", "label", "color", "data", "elem_type", "cidr_block",
+    "endpoint_type", "os_type", "network", "interfaces", "interface_from", "interface_to",
+    "line_type"]
+INTERFACE_FIELDS = ["label", "interface_id", "ipv4", "ipv6", "mac"]
+
+DEFAULT_FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sample_data",
+    "*EndState*.json")
+
+REPEAT = 20
+
+
+def expandElement(elem):
+    """Fills in every optional field the way the server returns elements."""
+    full = {field: elem.get(field) for field in ELEMENT_FIELDS}
+    if full["interfaces"] is not None:
+        full["interfaces"] = [{field: iface.get(field) for field in INTERFACE_FIELDS}
+            for iface in full["interfaces"]]
+    return full
+
+
+def timeIt(func):
+    """Returns the best-of-REPEAT wall time of func() in milliseconds."""
+    best = None
+    for i in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000.0
+
+
+def benchmark(path):
+    with open(path) as f:
+        payload = {"elements": [expandElement(elem) for elem in json.load(f)]}
+
+    print("%s (%d elements)" % (os.path.basename(path), len(payload["elements"])))
+    print("  %-14s %10s %8s %10s %10s" % ("format", "bytes", "ratio", "enc ms", "dec ms"))
+    baseline = None
+    for wireFormat in rpe21_client.WIRE_FORMATS:
+        for compression in rpe21_client.COMPRESSIONS:
+            if wireFormat == "msgpack" and rpe21_client.msgpack is None:
+                continue
+            if compression == "zstd" and rpe21_client.zstandard is None:
+                continue
+            name = wireFormat + ("+" + compression if compression else "")
+            body, headers = rpe21_client.encodeBody(payload, wireFormat, compression)
+            encMs = timeIt(lambda: rpe21_client.encodeBody(payload, wireFormat, compression))
+            if compression == "gzip":
+                # requests/urllib3 transparently gunzips response bodies
+                decode = lambda: rpe21_client.decodeBody(rpe21_client.gzip.decompress(body),
+                    headers["Content-Type"])
+            else:
+                decode = lambda: rpe21_client.decodeBody(body, headers["Content-Type"])
+            decMs = timeIt(decode)
+            if baseline is None:
+                baseline = len(body)
+            print("  %-14s %10d %7.1f%% %10.2f %10.2f" % (name, len(body),
+                100.0 * len(body) / baseline, encMs, decMs))
+    print()
+
+
+def main(args):
+    paths = args if args else sorted(glob.glob(DEFAULT_FILES))
+    for path in paths:
+        benchmark(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -13,9 +13,23 @@ validation.
 Copyright 2022-2023, Maryland Innovation and Security Institute
 """
 
+import gzip
 import json
 import requests
 import sys
+import time
+import urllib.parse
+from collections import OrderedDict
+
+# Optional wire formats - plain JSON works without these
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # Disable the warnings about lack of certificate validation - we want to allow
 # self-signed certificates with no warnings
@@ -28,45 +42,315 @@ class RPE21ClientError(Exception):
     pass
 
 
+# Valid values for the wireFormat and compression client options
+WIRE_FORMATS = ["json", "msgpack"]
+COMPRESSIONS = [None, "gzip", "zstd"]
+
+# First bytes of a zstd frame, used to spot responses that were not
+# transparently decompressed by requests/urllib3
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def stripNulls(value):
+    """Recursively drops null/absent fields from JSON-style data."""
+    if isinstance(value, dict):
+        return {k: stripNulls(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [stripNulls(v) for v in value]
+    return value
+
+
+def encodeBody(data, wireFormat="json", compression=None):
+    """Encodes a JSON-style request body in the given wire format. Returns the
+    encoded bytes and the Content-Type and Content-Encoding headers to send.
+    Null fields are omitted from all but the default (uncompressed JSON) format.
+    """
+    headers = {}
+    if wireFormat == "msgpack":
+        body = msgpack.packb(stripNulls(data))
+        headers["Content-Type"] = "application/msgpack"
+    else:
+        if compression:
+            data = stripNulls(data)
+        body = json.dumps(data).encode()
+        headers["Content-Type"] = "application/json"
+    if compression == "gzip":
+        body = gzip.compress(body, compresslevel=6)
+    elif compression == "zstd":
+        body = zstandard.ZstdCompressor().compress(body)
+    if compression:
+        headers["Content-Encoding"] = compression
+    return body, headers
+
+
+def decodeBody(content, contentType):
+    """Decodes a response body into JSON-style data given its Content-Type."""
+    if content.startswith(ZSTD_MAGIC):
+        content = zstandard.ZstdDecompressor().decompressobj().decompress(content)
+    if contentType.split(";")[0].strip() in ["application/msgpack", "application/x-msgpack"]:
+        return msgpack.unpackb(content)
+    return json.loads(content)
+
+
+# Header selecting the server-side namespace (isolated element store)
+NAMESPACE_HEADER = "X-RPE21-Namespace"
+
+
+class ElementCache:
+    """Client-side mirror of a server's elements, indexed by ID. Holds at most
+    maxSize elements, evicting the least recently used, along with each
+    element's ETag and when it was last known to be current. Elements known
+    to be current within maxAge seconds are used without asking the server.
+
+    Once a full list of elements has been read and fits, the cache is a
+    complete mirror, kept current as a whole with delta reads (GET
+    /elements?since=<ETag>) on servers that support them.
+    """
+
+    def __init__(self, maxSize, maxAge=0.0):
+        self.maxSize = maxSize
+        self.maxAge = maxAge
+        self.entries = OrderedDict()  # element ID -> [element, ETag, time checked]
+        self.expired = set()  # IDs that must be revalidated before use
+        self.complete = False
+        self.etag = None  # ETag of the last list read
+        self.checked = 0.0  # time of the last list read
+
+    def isMirror(self):
+        """Returns whether the cache holds every element and can be updated
+        with delta reads.
+        """
+        return self.complete and self.etag is not None
+
+    def isFresh(self, elementId=None):
+        """Returns whether an element (or, for a complete mirror, its absence)
+        is known to be current within maxAge. Without an ID, returns whether
+        the whole mirror is.
+        """
+        if elementId is None:
+            return not self.expired and time.monotonic() - self.checked < self.maxAge
+        if elementId in self.expired:
+            return False
+        checked = self.checked if self.isMirror() else None
+        entry = self.entries.get(elementId)
+        if entry is not None:
+            checked = entry[2] if checked is None else max(checked, entry[2])
+        return checked is not None and time.monotonic() - checked < self.maxAge
+
+    def lookup(self, elementId):
+        """Returns the [element, ETag, time checked] entry of an element, or
+        None if it isn't cached.
+        """
+        entry = self.entries.get(elementId)
+        if entry is not None:
+            self.entries.move_to_end(elementId)
+        return entry
+
+    def store(self, elementId, element, etag=None):
+        self.entries[elementId] = [element, etag, time.monotonic()]
+        self.entries.move_to_end(elementId)
+        self.expired.discard(elementId)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+            self.complete = False
+
+    def revalidated(self, elementId=None):
+        """Records that an element (or the whole mirror) is still current."""
+        if elementId is None:
+            self.checked = time.monotonic()
+            self.expired.clear()
+        else:
+            self.entries[elementId][2] = time.monotonic()
+            self.expired.discard(elementId)
+
+    def discard(self, elementId):
+        self.entries.pop(elementId, None)
+        self.expired.discard(elementId)
+
+    def expire(self, elementIds):
+        """Forces elements changed in ways the cache can't follow (e.g. merge
+        patches, or writes the server normalizes) to be revalidated before use.
+        Uncached IDs are only tracked by a complete mirror.
+        """
+        for elementId in elementIds:
+            if self.complete or elementId in self.entries:
+                self.expired.add(elementId)
+
+    def replace(self, elements, etag):
+        """Replaces the cache contents with a full list of elements."""
+        self.clear()
+        self.complete = True
+        for element in elements:
+            self.store(element["id"], element)
+        self.etag = etag
+        self.checked = time.monotonic()
+
+    def update(self, elements, deleted, etag):
+        """Applies a delta read to the mirror."""
+        for element in elements:
+            self.store(element["id"], element)
+        for elementId in deleted:
+            self.discard(elementId)
+        self.etag = etag
+        self.revalidated()
+
+    def clear(self):
+        self.entries.clear()
+        self.expired.clear()
+        self.complete = False
+        self.etag = None
+
+    def elements(self):
+        return [entry[0] for entry in self.entries.values()]
+
+
 class RPE21Client:
-    def __init__(self, baseURL, headers={}):
+    def __init__(self, baseURL, headers={}, wireFormat="json", compression=None,
+            namespace=None, timings=None, cacheSize=0, maxAge=0.0):
         """Initializes the client with the base REST API URL and any additional
         headers that must be supplied.
+
+        The wireFormat ("json" or "msgpack") and compression (None, "gzip" or
+        "zstd") options select a more compact encoding for request and response
+        bodies. The defaults keep the plain JSON traffic expected for the RPE.
+
+        If a namespace is given, all requests are made against that isolated
+        element store on servers that support namespaces. If a timings list is
+        given, an (api, seconds) tuple is appended to it for every request.
+
+        If cacheSize is nonzero, up to that many elements are cached locally
+        (see ElementCache) and revalidated with ETags rather than downloaded
+        again, or used as is for maxAge seconds. The client's own writes expire
+        the elements they change, so reads return the server's form. Elements
+        returned from the cache are shared with it, so they must not be
+        modified.
         """
+        if wireFormat not in WIRE_FORMATS:
+            raise RPE21ClientError('Invalid wire format "%s"' % (wireFormat,))
+        if compression not in COMPRESSIONS:
+            raise RPE21ClientError('Invalid compression "%s"' % (compression,))
+        if wireFormat == "msgpack" and msgpack is None:
+            raise RPE21ClientError("MessagePack wire format requires the msgpack package")
+        if compression == "zstd" and zstandard is None:
+            raise RPE21ClientError("zstd compression requires the zstandard package")
         self.url = baseURL
         self.headers = headers
-    
+        self.wireFormat = wireFormat
+        self.compression = compression
+        self.namespace = namespace
+        self.timings = timings
+        self.cache = ElementCache(cacheSize, maxAge) if cacheSize else None
+        # Headers implementing the options above; the response format is
+        # negotiated to match what we send
+        self.optionHeaders = {}
+        if namespace is not None:
+            self.optionHeaders[NAMESPACE_HEADER] = namespace
+        if wireFormat == "msgpack":
+            self.optionHeaders["Accept"] = "application/msgpack"
+        if compression:
+            self.optionHeaders["Accept-Encoding"] = compression
+            self.optionHeaders["Prefer"] = "omit-nulls"
+
+    def _request(self, method, path, body=None, prefer=None, extraHeaders=None):
+        """Sends a request with an (optional) JSON-style body encoded in the
+        configured wire format, and returns the response. The prefer argument
+        adds a preference to the Prefer header.
+        """
+        headers = dict(self.headers, **self.optionHeaders)
+        if extraHeaders:
+            headers.update(extraHeaders)
+        if prefer:
+            headers["Prefer"] = headers["Prefer"] + ", " + prefer if "Prefer" in headers else prefer
+        data = None
+        if body is not None:
+            data, bodyHeaders = encodeBody(body, self.wireFormat, self.compression)
+            headers.update(bodyHeaders)
+        if self.timings is None:
+            return requests.request(method, self.url + path, data=data, headers=headers, verify=False)
+        start = time.perf_counter()
+        resp = requests.request(method, self.url + path, data=data, headers=headers, verify=False)
+        # Report per-element APIs under a single name
+        api = path.split("?")[0]
+        if api.startswith("/element/"):
+            api = "/element/{id}"
+        self.timings.append(("%s %s" % (method, api), time.perf_counter() - start))
+        return resp
+
+    def _decode(self, resp):
+        """Returns the decoded body of a response."""
+        return decodeBody(resp.content, resp.headers.get("Content-Type", ""))
+
     def clearElements(self):
         """Removes all elements.
 
         NOTE: For the REST API response, only the status code matters.
         """
-        resp = requests.delete(self.url + "/elements", headers=self.headers, verify=False)
+        resp = self._request("DELETE", "/elements")
+        if self.cache is not None:
+            self.cache.clear()
         if resp.status_code != 200:
             raise RPE21ClientError("DELETE /elements returned %d" % (resp.status_code,))
 
     def getElements(self):
         """Returns a list of all elements."""
-        resp = requests.get(self.url + "/elements", headers=self.headers, verify=False)
+        cache = self.cache
+        if cache is not None and cache.isMirror():
+            if not cache.isFresh():
+                self._syncCache()
+            if cache.isMirror():
+                return cache.elements()
+        resp = self._request("GET", "/elements")
         if resp.status_code != 200:
             raise RPE21ClientError("GET /elements returned %d" % (resp.status_code,))
-        respJson = resp.json()
+        respJson = self._decode(resp)
         if "elements" not in respJson:
             raise RPE21ClientError("Invalid GET /elements response: %s" % (resp.text,))
+        if cache is not None:
+            cache.replace(respJson["elements"], resp.headers.get("ETag"))
         return respJson["elements"]
+
+    def _syncCache(self):
+        """Brings a complete mirror up to date with a delta read, or replaces
+        it if the server sends all elements instead.
+        """
+        cache = self.cache
+        resp = self._request("GET", "/elements?since=" + urllib.parse.quote(cache.etag),
+            extraHeaders={"If-None-Match": cache.etag})
+        if resp.status_code == 304:
+            cache.revalidated()
+            return
+        if resp.status_code != 200:
+            raise RPE21ClientError("GET /elements returned %d" % (resp.status_code,))
+        respJson = self._decode(resp)
+        if "elements" not in respJson:
+            raise RPE21ClientError("Invalid GET /elements response: %s" % (resp.text,))
+        if "deleted" in respJson:
+            cache.update(respJson["elements"], respJson["deleted"], resp.headers.get("ETag"))
+        else:
+            cache.replace(respJson["elements"], resp.headers.get("ETag"))
+
+    def getElementMap(self):
+        """Returns a map of element ID to element for all elements."""
+        cache = self.cache
+        elements = self.getElements()
+        if cache is not None and cache.isMirror():
+            return {elementId: entry[0] for elementId, entry in cache.entries.items()}
+        return {element["id"]: element for element in elements}
     
     def addElement(self, element):
         """Adds an element given its JSON definition and returns its endpoint."""
         # Grab the element ID from the provided element definition
         elementId = element["id"]
-        resp = requests.post(self.url + "/element", json=element, headers=self.headers, verify=False)
+        resp = self._request("POST", "/element", element)
         if resp.status_code == 400:
             return None  # element ID already exists
         if resp.status_code != 201:
             raise RPE21ClientError("POST /element returned %d" % (resp.status_code,))
-        respJson = resp.json()
+        respJson = self._decode(resp)
         if elementId not in respJson:
             raise RPE21ClientError("Invalid POST /element response: %s" % (resp.text,))
+        if self.cache is not None:
+            self.cache.expire([elementId])
         return respJson[elementId]
     
     def uploadElements(self, elements):
@@ -77,19 +361,57 @@ class RPE21Client:
         but the RPE Data Sender will NOT -- assigning a non-standard URL will impact
         your RPE performance.
         """
-        resp = requests.post(self.url + "/elements", json=elements, headers=self.headers, verify=False)
+        resp = self._request("POST", "/elements", elements)
         if resp.status_code == 403:
             return None  # all uploaded elements failed
         if resp.status_code != 201:
             raise RPE21ClientError("POST /elements returned %d" % (resp.status_code,))
-        respJson = resp.json()
+        respJson = self._decode(resp)
         # Removing this check, as any duplicate IDs in the input will yield fewer IDs
         # in the response (list vs. dictionary), and we assume the assigned URLs
         # follow the pattern /element/<id>
 #        if len(respJson) != len(elements):
 #            raise RPE21ClientError("Invalid POST /elements response: %s" % (resp.text,))
+        if self.cache is not None:
+            self.cache.expire(element["id"] for element in elements if element["id"] in respJson)
         return respJson
     
+    def uploadElementsAsync(self, elements, retries=3):
+        """Bulk upload multiple elements through the server's ingest queue.
+        Returns the ingest revision to pass to waitForRevision() once the upload
+        has been accepted. If the queue is full, the upload is retried after the
+        delay requested by the server (Retry-After), up to the given number of
+        times.
+
+        NOTE: Updates older (by timestamp) than the stored element are dropped.
+        """
+        for attempt in range(retries + 1):
+            resp = self._request("POST", "/elements", elements, prefer="respond-async")
+            if resp.status_code != 429 or attempt == retries:
+                break
+            time.sleep(float(resp.headers.get("Retry-After", "1")))
+        if resp.status_code != 202:
+            raise RPE21ClientError("POST /elements (async) returned %d" % (resp.status_code,))
+        if self.cache is not None:
+            # Queued updates may be applied later, or dropped as stale
+            self.cache.expire(element["id"] for element in elements)
+        return self._decode(resp)["revision"]
+
+    def waitForRevision(self, revision, timeout=30.0):
+        """Waits until the server has applied the given ingest revision, or the
+        timeout (in seconds) expires. Returns True if the revision was applied.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = max(0.0, deadline - time.monotonic())
+            resp = self._request("GET", "/ingest?revision=%d&timeout=%.3f" % (revision, remaining))
+            if resp.status_code != 200:
+                raise RPE21ClientError("GET /ingest returned %d" % (resp.status_code,))
+            if self._decode(resp)["applied"] >= revision:
+                return True
+            if remaining <= 0.0:
+                return False
+
     def updateElement(self, element):
         """Updates an existing element given its full, new JSON definition.
         
@@ -97,21 +419,49 @@ class RPE21Client:
         the original and new element definitions, but this is NOT required nor used.
         """
         elementId = element["id"]
-        resp = requests.put(self.url + "/element/" + elementId, json=element, headers=self.headers, verify=False)
+        resp = self._request("PUT", "/element/" + elementId, element)
         if resp.status_code == 404:
+            if self.cache is not None:
+                self.cache.discard(elementId)
             return False  # element ID does not exist
         if resp.status_code != 200:
             raise RPE21ClientError("PUT /element returned %d" % (resp.status_code,))
+        if self.cache is not None:
+            self.cache.expire([elementId])
         return True
     
     def getElement(self, elementId):
         """Retrieves a single element given its ID."""
-        resp = requests.get(self.url + "/element/" + elementId, headers=self.headers, verify=False)
+        cache = self.cache
+        entry = None
+        extraHeaders = None
+        if cache is not None:
+            if cache.isMirror():
+                if not cache.isFresh(elementId):
+                    self._syncCache()
+                if cache.isMirror():
+                    entry = cache.lookup(elementId)
+                    return entry[0] if entry is not None else None
+            entry = cache.lookup(elementId)
+            if entry is not None:
+                if cache.isFresh(elementId):
+                    return entry[0]
+                if entry[1] is not None:
+                    extraHeaders = {"If-None-Match": entry[1]}
+        resp = self._request("GET", "/element/" + elementId, extraHeaders=extraHeaders)
+        if resp.status_code == 304 and extraHeaders:
+            cache.revalidated(elementId)
+            return entry[0]
         if resp.status_code == 404:
+            if cache is not None:
+                cache.discard(elementId)
             return None  # element ID does not exist
         if resp.status_code != 200:
             raise RPE21ClientError("GET /element/%s returned %d" % (elementId, resp.status_code))
-        return resp.json()
+        element = self._decode(resp)
+        if cache is not None:
+            cache.store(elementId, element, resp.headers.get("ETag"))
+        return element
     
     def deleteElement(self, elementId):
         """Deletes a single element given its ID.
@@ -119,13 +469,72 @@ class RPE21Client:
         NOTE: For the RPE, only the status code matters. The example REST API returns
         the original element definition, but this is NOT required nor used.
         """
-        resp = requests.delete(self.url + "/element/" + elementId, headers=self.headers, verify=False)
+        resp = self._request("DELETE", "/element/" + elementId)
+        if self.cache is not None and resp.status_code in (200, 404):
+            self.cache.discard(elementId)
         if resp.status_code == 404:
             return False  # element ID does not exist
         if resp.status_code != 200:
             raise RPE21ClientError("DELETE /element/%s returned %d" % (elementId, resp.status_code))
         return True
     
+    def patchElement(self, elementId, patch):
+        """Applies a JSON merge patch to an existing element, e.g. {"color": "red"},
+        so that only the changed fields are sent. A null value removes a field.
+        """
+        resp = self._request("PATCH", "/element/" + elementId, patch)
+        if self.cache is not None:
+            self.cache.expire([elementId])
+        if resp.status_code == 404:
+            return False  # element ID does not exist
+        if resp.status_code != 200:
+            raise RPE21ClientError("PATCH /element/%s returned %d" % (elementId, resp.status_code))
+        return True
+
+    def patchElements(self, patches):
+        """Applies JSON merge patches to several elements given a map of element
+        ID to patch. Returns the map of element ID to URL of the patched elements,
+        or None if none of them exist.
+        """
+        resp = self._request("PATCH", "/elements", patches)
+        if self.cache is not None:
+            self.cache.expire(patches)
+        if resp.status_code == 404:
+            return None  # no element IDs exist
+        if resp.status_code != 200:
+            raise RPE21ClientError("PATCH /elements returned %d" % (resp.status_code,))
+        return self._decode(resp)
+
+    def patchWhere(self, filters, patch):
+        """Applies a JSON merge patch to every element whose fields match the
+        filters, e.g. patchWhere({"elem_type": "endpoint", "network": "dmz_1"},
+        {"color": "red"}). Returns the map of element ID to URL of the patched
+        elements, which is empty if none matched or could be patched.
+        """
+        resp = self._request("PATCH", "/elements/filter?" + urllib.parse.urlencode(filters), patch)
+        if resp.status_code == 404:
+            return {}  # no elements patched
+        if resp.status_code != 200:
+            raise RPE21ClientError("PATCH /elements/filter returned %d" % (resp.status_code,))
+        respJson = self._decode(resp)
+        if self.cache is not None:
+            self.cache.expire(respJson)
+        return respJson
+
+    def deleteWhere(self, filters):
+        """Deletes every element whose fields match the filters, e.g.
+        deleteWhere({"elem_type": "connection", "line_type": "dashed"}). Returns
+        the list of deleted element IDs.
+        """
+        resp = self._request("DELETE", "/elements/filter?" + urllib.parse.urlencode(filters))
+        if resp.status_code != 200:
+            raise RPE21ClientError("DELETE /elements/filter returned %d" % (resp.status_code,))
+        deleted = self._decode(resp)["deleted"]
+        if self.cache is not None:
+            for elementId in deleted:
+                self.cache.discard(elementId)
+        return deleted
+
     def getImage(self):
         """Retrieves the current visualization as an image file.
 
@@ -134,7 +543,7 @@ class RPE21Client:
         For the RPE, the images will be saved for post-event manual review. This is a required
         feature for the desired capability.
         """
-        resp = requests.get(self.url + "/image", headers=self.headers, verify=False)
+        resp = self._request("GET", "/image")
         if resp.status_code != 200:
             raise RPE21ClientError("GET /image returned %d" % (resp.status_code,))
         contentType = resp.headers["Content-Type"]
@@ -162,6 +571,8 @@ class RPE21Client:
             raise RPE21ClientError('Invalid method "%s"' % (methodStr,))
         
         resp = method(self.url + endpoint, headers=self.headers, data=dataStr, verify=False)
+        if self.cache is not None and methodStr != "GET":
+            self.cache.clear()  # can't tell what changed
         return (resp.status_code, resp.json())
 
 
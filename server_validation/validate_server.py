@@ -7,13 +7,24 @@ of their capability AND to identify any integration issues prior to the event.
 For competitors with special headers (e.g., API key), the spot to change in the
 code is identified below.
 
+Optionally, test cases can run concurrently (--parallel N) when the server
+supports namespaces, since each test case then gets its own isolated element
+store. Per-test and per-request timings, including p95 latency for each API,
+are reported with --timings (implied by --parallel).
+
 Copyright 2022-2023, Maryland Innovation and Security Institute
 """
 
+import argparse
 import json
+import math
 import rpe21_client
 import sys
+import threading
+import time
 import unittest
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 # This gets filled in from the command line
 BASE_URL = None
@@ -21,6 +32,14 @@ BASE_URL = None
 # Add your headers here if necessary
 HEADERS = {}
 
+# Parallel mode gives each test case a namespace starting with this prefix
+NAMESPACE_PREFIX = None
+
+# When timing, a (test ID, seconds, [(api, seconds), ...]) tuple is recorded
+# here for every test case
+TIMINGS = None
+timingsLock = threading.Lock()
+
 
 class TestRestApi(unittest.TestCase):
     # Test elements (string form)
@@ -37,14 +56,26 @@ class TestRestApi(unittest.TestCase):
 "interface_to": "redirector_1_eth0", "line_type": "solid"}'
 
     def setUp(self):
+        self.startTime = time.perf_counter()
+        self.timings = [] if TIMINGS is not None else None
+        namespace = None
+        if NAMESPACE_PREFIX is not None:
+            namespace = NAMESPACE_PREFIX + self._testMethodName
         # NOTE: Add your custom headers here as the second parameter
-        self.client = rpe21_client.RPE21Client(BASE_URL, HEADERS)
+        self.client = rpe21_client.RPE21Client(BASE_URL, HEADERS, namespace=namespace,
+            timings=self.timings)
         # Ensure each test case starts with a clean slate. If this API doesn't
         # work, nearly all tests will fail
         self.client.clearElements()
 
     def tearDown(self):
-        pass
+        if NAMESPACE_PREFIX is not None:
+            # Don't leave per-test namespaces behind on the server - clearing
+            # one also drops it on servers like the example REST API
+            self.client.clearElements()
+        if TIMINGS is not None:
+            with timingsLock:
+                TIMINGS.append((self.id(), time.perf_counter() - self.startTime, self.timings))
 
     def test_get_all_elements_empty(self):
         elements = self.client.getElements()
@@ -223,10 +254,11 @@ class TestRestApi(unittest.TestCase):
         # Elements were altered
         elements = self.client.getElements()
         self.assertEqual(len(elements), 2)
-        elem = self._findElement(elements, "dmz_1")
+        elements = self._indexById(elements)
+        elem = elements.get("dmz_1")
         self.assertIsNotNone(elem)
         self.assertEqual(elem["color"], "orange")
-        elem = self._findElement(elements, "wordpress_1")
+        elem = elements.get("wordpress_1")
         self.assertIsNotNone(elem)
         self.assertEqual(elem["color"], "orange")
     
@@ -247,13 +279,14 @@ class TestRestApi(unittest.TestCase):
         # Element was altered
         elements = self.client.getElements()
         self.assertEqual(len(elements), 3)
-        elem = self._findElement(elements, "dmz_1")
+        elements = self._indexById(elements)
+        elem = elements.get("dmz_1")
         self.assertIsNotNone(elem)
         self.assertEqual(elem["color"], "orange")
-        elem = self._findElement(elements, "wordpress_1")
+        elem = elements.get("wordpress_1")
         self.assertIsNotNone(elem)
         self.assertEqual(elem["color"], "red")
-        elem = self._findElement(elements, "ssh_tunnel_1")
+        elem = elements.get("ssh_tunnel_1")
         self.assertIsNotNone(elem)
     
     def test_get_image(self):
@@ -270,17 +303,133 @@ class TestRestApi(unittest.TestCase):
         image = self.client.getImage()
         self.assertIsNotNone(image)
 
-    def _findElement(self, elem_list, id):
-        for elem in elem_list:
-            if elem["id"] == id:
-                return elem
-        return None
+    def _indexById(self, elem_list):
+        return {elem["id"]: elem for elem in elem_list}
+
+
+def percentile(values, pct):
+    """Returns the pct-th percentile (nearest rank) of a list of values."""
+    values = sorted(values)
+    return values[max(0, math.ceil(pct / 100.0 * len(values)) - 1)]
+
+
+def supportsNamespaces():
+    """Checks whether the server keeps namespaces isolated from each other."""
+    probe = "validate-probe-%s-" % (uuid.uuid4().hex[:8],)
+    clientA = rpe21_client.RPE21Client(BASE_URL, HEADERS, namespace=probe + "a")
+    clientB = rpe21_client.RPE21Client(BASE_URL, HEADERS, namespace=probe + "b")
+    clientA.clearElements()
+    clientB.clearElements()
+    clientA.addElement(json.loads(TestRestApi.DMZ_1))
+    isolated = len(clientB.getElements()) == 0
+    clientA.clearElements()
+    clientB.clearElements()
+    return isolated
+
+
+def runParallel(suite, workers):
+    """Runs every test case in the suite on a pool of worker threads and prints
+    the combined results in the style of unittest.TextTestRunner.
+    """
+    tests = []
+    pending = [suite]
+    while pending:
+        item = pending.pop(0)
+        if isinstance(item, unittest.TestSuite):
+            pending[0:0] = list(item)
+        else:
+            tests.append(item)
+
+    def runTest(test):
+        result = unittest.TestResult()
+        test(result)
+        return result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(runTest, tests))
+    elapsed = time.perf_counter() - start
+
+    failures = []
+    errors = []
+    skipped = expectedFailures = unexpectedSuccesses = 0
+    for result in results:
+        failures += result.failures
+        errors += result.errors
+        skipped += len(result.skipped)
+        expectedFailures += len(result.expectedFailures)
+        unexpectedSuccesses += len(result.unexpectedSuccesses)
+    for kind, problems in (("ERROR", errors), ("FAIL", failures)):
+        for test, trace in problems:
+            print("=" * 70)
+            print("%s: %s" % (kind, test.id()))
+            print("-" * 70)
+            print(trace)
+    print("-" * 70)
+    print("Ran %d tests in %.3fs with %d workers" % (len(tests), elapsed, workers))
+    print()
+    notes = []
+    if failures:
+        notes.append("failures=%d" % (len(failures),))
+    if errors:
+        notes.append("errors=%d" % (len(errors),))
+    if skipped:
+        notes.append("skipped=%d" % (skipped,))
+    if expectedFailures:
+        notes.append("expected failures=%d" % (expectedFailures,))
+    if unexpectedSuccesses:
+        notes.append("unexpected successes=%d" % (unexpectedSuccesses,))
+    status = "FAILED" if failures or errors or unexpectedSuccesses else "OK"
+    print(status + (" (%s)" % (", ".join(notes),) if notes else ""))
+    return status == "OK"
+
+
+def printTimings():
+    """Prints per-test times and per-API request latencies."""
+    print()
+    print("%-60s %10s %9s" % ("Test", "seconds", "requests"))
+    for testId, seconds, requests in sorted(TIMINGS):
+        print("%-60s %10.3f %9d" % (testId.split(".")[-1], seconds, len(requests)))
+
+    byApi = {}
+    for testId, seconds, requests in TIMINGS:
+        for api, latency in requests:
+            byApi.setdefault(api, []).append(latency * 1000.0)
+    print()
+    print("%-24s %8s %10s %10s %10s" % ("API", "count", "mean ms", "p95 ms", "max ms"))
+    for api in sorted(byApi):
+        latencies = byApi[api]
+        print("%-24s %8d %10.2f %10.2f %10.2f" % (api, len(latencies),
+            sum(latencies) / len(latencies), percentile(latencies, 95), max(latencies)))
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print('usage: validate_server.py <url>')
+    parser = argparse.ArgumentParser(usage='validate_server.py <url> [--parallel N] [--timings] [unittest options]')
+    parser.add_argument('url', help="base URL of the REST API")
+    parser.add_argument('-j', '--parallel', type=int, default=0, metavar='N',
+        help="run test cases concurrently on N worker threads (needs namespace support)")
+    parser.add_argument('--timings', action='store_true', help="report per-test and per-API timings")
+    args, unittestArgs = parser.parse_known_args()
+    BASE_URL = args.url
+    if args.timings or args.parallel:
+        TIMINGS = []
+
+    if args.parallel > 1 and not supportsNamespaces():
+        print('WARNING: server does not isolate namespaces, running test cases serially')
+        args.parallel = 0
+
+    if args.parallel > 1:
+        NAMESPACE_PREFIX = "validate-%s-" % (uuid.uuid4().hex[:8],)
+        names = [arg for arg in unittestArgs if not arg.startswith('-')]
+        loader = unittest.defaultTestLoader
+        if names:
+            suite = loader.loadTestsFromNames(names, sys.modules[__name__])
+        else:
+            suite = loader.loadTestsFromModule(sys.modules[__name__])
+        success = runParallel(suite, args.parallel)
     else:
-        BASE_URL = sys.argv[1]
-        sys.argv.pop(1)
-        unittest.main()
+        program = unittest.main(argv=[sys.argv[0]] + unittestArgs, exit=False)
+        success = program.result.wasSuccessful()
+    if TIMINGS is not None:
+        printTimings()
+    sys.exit(0 if success else 1)
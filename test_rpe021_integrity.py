@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the reference index and integrity modes of the example REST
+API (rpe021_example.py), which can run without a server:
+    python3 -m unittest test_rpe021_integrity
+
+Copyright 2022-2023, Maryland Innovation and Security Institute
+"""
+
+import random
+import unittest
+
+from fastapi import HTTPException
+
+import rpe021_example
+from rpe021_example import Element, ElementStore, ReferenceIndex
+
+TIMESTAMP = '2023-01-01T00:00:00'
+
+
+def network(id):
+    return Element(id=id, timestamp=TIMESTAMP, label=id, color='green', elem_type='network')
+
+
+def endpoint(id, net, ifaces):
+    return Element(id=id, timestamp=TIMESTAMP, label=id, color='green', elem_type='endpoint', network=net,
+        interfaces=[{'label': iface, 'interface_id': iface} for iface in ifaces])
+
+
+def connection(id, iface_from, iface_to):
+    return Element(id=id, timestamp=TIMESTAMP, label=id, color='green', elem_type='connection',
+        interface_from=iface_from, interface_to=iface_to)
+
+
+def expected_dangling(elements):
+    """Recompute the dangling references of a set of elements from scratch."""
+    provided = set()
+    for element in elements.values():
+        provided.update(ReferenceIndex.targets_of(element))
+    return {(element.id, field, target) for element in elements.values()
+        for field, target in ReferenceIndex.references_of(element) if target not in provided}
+
+
+def random_element(rng):
+    """Return a random element from a small pool of IDs, networks and
+    interfaces, so that references are often (but not always) resolved.
+    """
+    kind = rng.choice(['network', 'endpoint', 'endpoint', 'connection'])
+    if kind == 'network':
+        return network('n%d' % rng.randrange(4))
+    if kind == 'endpoint':
+        ifaces = rng.sample(['i%d' % i for i in range(10)], rng.randrange(3))
+        net = rng.choice(['n%d' % i for i in range(5)] + [None])
+        return endpoint('e%d' % rng.randrange(8), net, ifaces)
+    return connection('c%d' % rng.randrange(8), 'i%d' % rng.randrange(11), 'i%d' % rng.randrange(11))
+
+
+class TestReferenceIndex(unittest.TestCase):
+
+    def assertIndexCurrent(self, store):
+        self.assertEqual(store.refs.dangling, expected_dangling(store.elements))
+        rebuilt = ReferenceIndex()
+        rebuilt.rebuild(store.elements.values())
+        self.assertEqual(store.refs.providers, rebuilt.providers)
+        self.assertEqual(store.refs.referrers, rebuilt.referrers)
+        self.assertEqual(store.refs.dangling, rebuilt.dangling)
+
+    def test_random_mutations(self):
+        for mode in rpe021_example.INTEGRITY_MODES:
+            for seed in range(5):
+                with self.subTest(mode=mode, seed=seed):
+                    rng = random.Random(seed)
+                    store = ElementStore('test')
+                    for step in range(300):
+                        if rng.random() < 0.7:
+                            # Updates replace an element, possibly of another kind
+                            rpe021_example.put_elements(store, [random_element(rng)], mode)
+                        elif store.elements:
+                            try:
+                                store.remove(rng.choice(sorted(store.elements)), mode)
+                            except HTTPException as e:
+                                self.assertEqual((mode, e.status_code), ('strict', 409))
+                        self.assertIndexCurrent(store)
+                        if mode == 'strict':
+                            self.assertEqual(store.refs.dangling, set())
+
+    def test_bulk_load(self):
+        rng = random.Random(0)
+        store = ElementStore('test')
+        store.load([random_element(rng) for i in range(100)])
+        self.assertIndexCurrent(store)
+
+    def make_store(self):
+        store = ElementStore('test')
+        store.load([network('n'), network('m'), endpoint('e1', 'n', ['i1']), endpoint('e2', 'n', ['i2']),
+            endpoint('e3', 'm', ['i3']), connection('c1', 'i1', 'i3'), connection('c2', 'i2', 'i3'),
+            connection('c3', 'i3', 'i3')])
+        self.assertEqual(store.refs.dangling, set())
+        return store
+
+    def test_cascade_delete_network(self):
+        store = self.make_store()
+        self.assertIsNotNone(store.remove('n', 'cascade'))
+        self.assertEqual(sorted(store.elements), ['c3', 'e3', 'm'])
+        self.assertIndexCurrent(store)
+        self.assertEqual(store.refs.dangling, set())
+
+    def test_cascade_update(self):
+        store = self.make_store()
+        # Renaming e3's interface leaves every connection to it dangling
+        store.put(endpoint('e3', 'm', ['i4']), 'cascade')
+        self.assertEqual(sorted(store.elements), ['e1', 'e2', 'e3', 'm', 'n'])
+        self.assertIndexCurrent(store)
+
+    def test_strict_delete_network(self):
+        store = self.make_store()
+        with self.assertRaises(HTTPException) as cm:
+            store.remove('n', 'strict')
+        self.assertEqual(cm.exception.status_code, 409)
+        self.assertEqual(len(store.elements), 8)
+        self.assertIndexCurrent(store)
+
+    def test_lenient_delete_network(self):
+        store = self.make_store()
+        store.remove('n')
+        self.assertEqual(store.refs.dangling, {('e1', 'network', ('network', 'n')),
+            ('e2', 'network', ('network', 'n'))})
+        self.assertIndexCurrent(store)
+
+    def test_strict_batch(self):
+        store = ElementStore('test')
+        # References may be satisfied by later elements of the same list
+        stored = rpe021_example.put_elements(store, [connection('c1', 'i1', 'i2'), endpoint('e1', 'n', ['i1', 'i2']),
+            network('n'), connection('c2', 'i1', 'nope')], 'strict')
+        self.assertEqual(stored, ['c1', 'e1', 'n'])
+        self.assertEqual(store.refs.dangling, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the streaming end-state reader (rpe021_stream.py), which can
+run without a server:
+    python3 -m unittest test_rpe021_stream
+
+Copyright 2022-2023, Maryland Innovation and Security Institute
+"""
+
+import glob
+import io
+import json
+import os
+import unittest
+
+import rpe021_stream
+
+SAMPLE_FILES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'sample_data', '*.json')))
+
+# Tiny chunks make values, numbers and literals straddle buffer refills.
+# Every refill re-decodes the pending value, so the sample files use
+# slightly larger chunks to keep the tests quick
+CHUNK_SIZES = [1, 2, 3, 7, 64, rpe021_stream.CHUNK_SIZE]
+FILE_CHUNK_SIZES = [7, 64, 4096, rpe021_stream.CHUNK_SIZE]
+
+
+def parse(text, chunk_size):
+    return list(rpe021_stream.iter_elements(io.StringIO(text), chunk_size))
+
+
+class TestStream(unittest.TestCase):
+
+    def test_sample_files(self):
+        self.assertTrue(SAMPLE_FILES)
+        for path in SAMPLE_FILES:
+            with open(path) as f:
+                expected = json.load(f)
+            if not isinstance(expected, list):
+                expected = [expected]
+            for chunk_size in FILE_CHUNK_SIZES:
+                with self.subTest(path=os.path.basename(path), chunk_size=chunk_size):
+                    with open(path) as f:
+                        self.assertEqual(list(rpe021_stream.iter_elements(f, chunk_size)), expected)
+
+    def test_ndjson(self):
+        with open(SAMPLE_FILES[0]) as f:
+            expected = json.load(f)
+        text = '\n'.join(json.dumps(element) for element in expected) + '\n'
+        for chunk_size in FILE_CHUNK_SIZES:
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(parse(text, chunk_size), expected)
+
+    def test_scalars(self):
+        text = '[1, 2.5e-3 ,{"a":[]}, 300, true,null, "x,]"]'
+        for chunk_size in CHUNK_SIZES:
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(parse(text, chunk_size), json.loads(text))
+
+    def test_empty(self):
+        for text in ['', '  \n', '[]', ' [ ] \n']:
+            for chunk_size in CHUNK_SIZES:
+                with self.subTest(text=text, chunk_size=chunk_size):
+                    self.assertEqual(parse(text, chunk_size), [])
+
+    def test_malformed(self):
+        for text in ['[1,]', '[,]', '[,1]', '[1 2]', '[1,', '[1', '[{"a":1', '[1] 2', '{"a":1}x']:
+            for chunk_size in CHUNK_SIZES:
+                with self.subTest(text=text, chunk_size=chunk_size):
+                    with self.assertRaises(ValueError):
+                        parse(text, chunk_size)
+
+
+if __name__ == '__main__':
+    unittest.main()